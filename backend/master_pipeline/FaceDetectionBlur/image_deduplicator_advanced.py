@@ -24,11 +24,16 @@ Usage:
 import cv2
 import numpy as np
 import hashlib
+import mmap
+import os
+import re
+import sqlite3
 import argparse
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from collections import defaultdict
 from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 import shutil
 import warnings
 warnings.filterwarnings('ignore')
@@ -63,6 +68,44 @@ except ImportError:
     PIL_AVAILABLE = False
 
 
+# File types scan_images() picks up
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.gif', '.tiff', '.tif', '.avif'})
+
+
+def _hash_file(filepath: Path) -> Tuple[Path, Optional[str]]:
+    """
+    MD5 of a file's contents, read through mmap (hashing thread).
+    
+    Returns (filepath, None) if the file can't be read, so one bad file
+    doesn't abort the whole pool; analyze_image then reports the error.
+    """
+    hasher = hashlib.md5()
+    try:
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    hasher.update(mm)
+    except OSError:
+        return filepath, None
+    return filepath, hasher.hexdigest()
+
+
+def filename_sort_key(filename: str) -> Tuple[int, object]:
+    """
+    Sort key deciding which of two duplicates is the original.
+    
+    Files are ordered by the first number in their name (lower number =
+    original); names without a number sort after all numbered ones.
+    """
+    nums = re.findall(r'\d+', filename)
+    # Return a tuple: (is_numeric, value) for consistent sorting
+    # This ensures we can always compare - numbers sort before strings
+    if nums:
+        return (0, int(nums[0]))  # Numeric: priority 0
+    else:
+        return (1, filename)  # String: priority 1
+
+
 def load_image(filepath: Path) -> Optional[np.ndarray]:
     """Load image with support for AVIF and other formats."""
     # Try OpenCV first (faster for standard formats)
@@ -109,6 +152,79 @@ class ImageInfo:
     match_reason: str = ""
 
 
+class FeatureCache:
+    """
+    SQLite cache of per-image features, keyed by the file's MD5 and the
+    perceptual hash method used.
+    
+    Feature extraction (YOLO segmentation, ORB, histograms) dominates a
+    scan, and files already downloaded don't change between runs, so only
+    new content has to be analyzed again.
+    """
+    
+    def __init__(self, db_path: Path, hash_method: str = 'phash'):
+        self.hash_method = hash_method
+        # Not shared concurrently, but may be handed from a prefetch thread
+        # (see AdvancedDeduplicator.add_image) to the thread running the scan
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS features (
+                md5 TEXT,
+                hash_method TEXT,
+                phash TEXT,
+                background_hist BLOB,
+                edge_features BLOB,
+                orb_descriptors BLOB,
+                width INTEGER,
+                height INTEGER,
+                has_human INTEGER,
+                PRIMARY KEY (md5, hash_method)
+            )
+        """)
+        self.pending = []
+        self.hits = 0
+    
+    def load(self, info: ImageInfo) -> bool:
+        """Fill info's features from the cache. Returns False on a miss."""
+        row = self.conn.execute(
+            "SELECT phash, background_hist, edge_features, orb_descriptors, width, height, has_human "
+            "FROM features WHERE md5 = ? AND hash_method = ?", (info.md5_hash, self.hash_method)
+        ).fetchone()
+        if row is None:
+            return False
+        
+        phash, hist, edges, orb, width, height, has_human = row
+        info.phash = phash
+        info.background_hist = np.frombuffer(hist, dtype=np.float32)
+        info.edge_features = np.frombuffer(edges, dtype=np.float32)
+        # ORB descriptors are 32 bytes each; None when no keypoints were found
+        info.orb_descriptors = np.frombuffer(orb, dtype=np.uint8).reshape(-1, 32) if orb is not None else None
+        info.dimensions = (width, height)
+        info.has_human = bool(has_human)
+        self.hits += 1
+        return True
+    
+    def add(self, info: ImageInfo):
+        """Queue an analyzed image's features for the next flush()."""
+        orb = info.orb_descriptors.tobytes() if info.orb_descriptors is not None else None
+        self.pending.append((
+            info.md5_hash, self.hash_method, info.phash,
+            info.background_hist.astype(np.float32).tobytes(),
+            info.edge_features.astype(np.float32).tobytes(),
+            orb, info.dimensions[0], info.dimensions[1], int(info.has_human)
+        ))
+    
+    def flush(self):
+        """Write queued features in one transaction."""
+        if self.pending:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending
+                )
+            self.pending = []
+
+
 class SceneDetector:
     """Detect same scene/session images."""
     
@@ -232,6 +348,19 @@ class SceneDetector:
         hash_bits = (dct_low.flatten() > med).astype(int)
         return ''.join(map(str, hash_bits))
     
+    def compute_dhash(self, image: np.ndarray, size: int = 8) -> str:
+        """
+        Compute difference hash (64 bits, same format as compute_phash).
+        
+        Compares horizontally adjacent pixels of a 9x8 thumbnail. Much
+        cheaper than the DCT and as good at catching re-encoded or resized
+        copies.
+        """
+        resized = cv2.resize(image, (size + 1, size), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+        hash_bits = (gray[:, 1:] > gray[:, :-1]).flatten().astype(int)
+        return ''.join(map(str, hash_bits))
+    
     def compare_histograms(self, hist1: np.ndarray, hist2: np.ndarray) -> float:
         """Compare two histograms. Returns similarity (0-1)."""
         if hist1 is None or hist2 is None:
@@ -283,7 +412,8 @@ class SceneDetector:
 class AdvancedDeduplicator:
     """Advanced deduplication with scene detection."""
     
-    def __init__(self, similarity_threshold: float = 0.6):
+    def __init__(self, similarity_threshold: float = 0.6, cache_path: Optional[Path] = None,
+                 hash_method: str = 'phash'):
         """
         Initialize deduplicator.
         
@@ -292,10 +422,16 @@ class AdvancedDeduplicator:
                                   0.5 = lenient (catches more)
                                   0.6 = moderate (default)
                                   0.7 = strict (fewer matches)
+            cache_path: Optional SQLite file to cache image features across runs
+            hash_method: Perceptual hash for near-exact matches, 'phash' (DCT)
+                         or 'dhash' (difference hash, faster)
         """
         self.threshold = similarity_threshold
+        self.hash_method = hash_method
+        self.cache = FeatureCache(cache_path, hash_method) if cache_path else None
         self.detector = SceneDetector()
         self.images: List[ImageInfo] = []
+        self.prefetched: Dict[Path, ImageInfo] = {}
         self.duplicate_groups: Dict[str, List[ImageInfo]] = defaultdict(list)
     
     def compute_md5(self, filepath: Path) -> str:
@@ -306,7 +442,35 @@ class AdvancedDeduplicator:
                 hasher.update(chunk)
         return hasher.hexdigest()
     
-    def analyze_image(self, filepath: Path) -> ImageInfo:
+    def compute_md5_parallel(self, image_files: List[Path]) -> Dict[Path, str]:
+        """
+        Compute MD5 hashes for many files across all CPU cores.
+        
+        Hashing every file is the one cost a feature cache hit can't avoid,
+        so on a warm cache it dominates the scan. hashlib releases the GIL
+        while hashing, so threads scale without forking a process that may
+        already have torch (and CUDA) loaded.
+        
+        Args:
+            image_files: Files to hash
+            
+        Returns:
+            Dict mapping each readable file to its MD5 hex digest
+        """
+        if len(image_files) < 64:
+            return {}
+        
+        hashes = {}
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = executor.map(_hash_file, image_files)
+            if TQDM_AVAILABLE:
+                results = tqdm(results, total=len(image_files), desc="Hashing")
+            for filepath, md5_hash in results:
+                if md5_hash is not None:
+                    hashes[filepath] = md5_hash
+        return hashes
+    
+    def analyze_image(self, filepath: Path, md5_hash: Optional[str] = None) -> ImageInfo:
         """Analyze single image and extract all features."""
         info = ImageInfo(
             path=filepath,
@@ -314,8 +478,12 @@ class AdvancedDeduplicator:
             file_size=filepath.stat().st_size
         )
         
-        # MD5 hash
-        info.md5_hash = self.compute_md5(filepath)
+        # MD5 hash (precomputed by scan_images when hashing in parallel)
+        info.md5_hash = md5_hash or self.compute_md5(filepath)
+        
+        # Same content analyzed on an earlier run
+        if self.cache and self.cache.load(info):
+            return info
         
         # Load image (supports AVIF and other formats)
         image = load_image(filepath)
@@ -336,30 +504,80 @@ class AdvancedDeduplicator:
         info.edge_features = self.detector.compute_edge_signature(image, bg_mask)
         info.orb_descriptors = self.detector.compute_orb_features(image, bg_mask)
         
-        # Also compute pHash on full image (for exact duplicates)
-        info.phash = self.detector.compute_phash(image)
+        # Also compute perceptual hash on full image (for exact duplicates)
+        if self.hash_method == 'dhash':
+            info.phash = self.detector.compute_dhash(image)
+        else:
+            info.phash = self.detector.compute_phash(image)
+        
+        if self.cache:
+            self.cache.add(info)
         
         return info
     
-    def scan_images(self, input_dir: Path) -> List[ImageInfo]:
-        """Scan directory and analyze all images."""
-        exts = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.gif', '.tiff', '.tif', '.avif'}
-        image_files = [f for f in input_dir.iterdir() if f.suffix.lower() in exts]
+    def add_image(self, filepath: Path):
+        """
+        Analyze one image ahead of scan_images.
+        
+        Lets a caller overlap analysis with whatever is producing the files
+        (e.g. downloads); scan_images then reuses the result instead of
+        analyzing the file again. Call from one thread at a time.
+        
+        Args:
+            filepath: Image file that will be in scan_images' input_dir
+        """
+        # scan_images would never use it
+        if filepath.suffix.lower() not in IMAGE_EXTENSIONS:
+            return
+        try:
+            self.prefetched[filepath] = self.analyze_image(filepath)
+        except Exception as e:
+            print(f"⚠ Error processing {filepath.name}: {e}")
+    
+    def scan_images(self, input_dir: Path, exclude: Optional[set] = None) -> List[ImageInfo]:
+        """
+        Scan directory and analyze all images.
+        
+        Args:
+            input_dir: Directory of images
+            exclude: Optional filenames to leave out (e.g. duplicates already
+                     resolved by a cheaper prefilter)
+        """
+        image_files = [f for f in input_dir.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS]
+        if exclude:
+            image_files = [f for f in image_files if f.name not in exclude]
         
         print(f"📷 Found {len(image_files)} images")
         print(f"🔧 Analyzing images (extracting background features)...")
         
+        # Images already analyzed through add_image are reused as-is
+        to_analyze = [f for f in image_files if f not in self.prefetched]
+        if len(to_analyze) < len(image_files):
+            print(f"   - Analyzed during download: {len(image_files) - len(to_analyze)}/{len(image_files)}")
+        
+        md5_hashes = self.compute_md5_parallel(to_analyze)
+        
         images = []
         iterator = tqdm(image_files, desc="Analyzing") if TQDM_AVAILABLE else image_files
         
         for filepath in iterator:
+            if filepath in self.prefetched:
+                images.append(self.prefetched.pop(filepath))
+                continue
             try:
-                info = self.analyze_image(filepath)
+                info = self.analyze_image(filepath, md5_hashes.get(filepath))
                 images.append(info)
             except Exception as e:
                 print(f"⚠ Error processing {filepath.name}: {e}")
         
         self.images = images
+        # Drop prefetched results for excluded files
+        self.prefetched.clear()
+        
+        if self.cache:
+            self.cache.flush()
+            print(f"   - Loaded from feature cache: {self.cache.hits}/{len(images)}")
+            self.cache.hits = 0
         
         # Summary
         humans_count = sum(1 for img in images if img.has_human)
@@ -430,24 +648,52 @@ class AdvancedDeduplicator:
         
         n = len(self.images)
         
-        # Store all matching pairs with their similarity
-        matching_pairs = []  # [(img1, img2, similarity, reason), ...]
-        
-        # Compare all pairs
-        total_comparisons = n * (n - 1) // 2
-        print(f"   Comparing {n} images ({total_comparisons} pairs)...")
+        # Byte-identical files have identical features, so only one image per
+        # MD5 needs comparing; its matches apply to every copy
+        md5_groups = defaultdict(list)  # md5 -> indices into self.images
+        for idx, img in enumerate(self.images):
+            md5_groups[img.md5_hash].append(idx)
+        groups = list(md5_groups.values())
+        
+        # Matching pairs as (i, j, similarity, reason) with i < j
+        index_pairs = []
+        
+        # Copies of the same file always match each other
+        for members in groups:
+            for a in range(len(members)):
+                for b in range(a + 1, len(members)):
+                    img1, img2 = self.images[members[a]], self.images[members[b]]
+                    similarity, reason = self.compute_similarity(img1, img2)
+                    if similarity >= self.threshold:
+                        index_pairs.append((members[a], members[b], similarity, reason))
+        
+        # Compare all pairs of distinct files
+        g = len(groups)
+        total_comparisons = g * (g - 1) // 2
+        if g < n:
+            print(f"   Collapsed {n - g} exact copies (same MD5)")
+        print(f"   Comparing {g} images ({total_comparisons} pairs)...")
         
         if TQDM_AVAILABLE:
             pbar = tqdm(total=total_comparisons, desc="Comparing")
         
-        for i in range(n):
-            for j in range(i + 1, n):
-                img1, img2 = self.images[i], self.images[j]
+        for gi in range(g):
+            for gj in range(gi + 1, g):
+                group1, group2 = groups[gi], groups[gj]
                 
-                similarity, reason = self.compute_similarity(img1, img2)
+                # compute_similarity is called as (earlier, later) image, so a
+                # copy of group2 listed before a copy of group1 needs the
+                # reverse comparison
+                results = {True: self.compute_similarity(self.images[group1[0]], self.images[group2[0]])}
                 
-                if similarity >= self.threshold:
-                    matching_pairs.append((img1, img2, similarity, reason))
+                for i in group1:
+                    for j in group2:
+                        forward = i < j
+                        if forward not in results:
+                            results[forward] = self.compute_similarity(self.images[group2[0]], self.images[group1[0]])
+                        similarity, reason = results[forward]
+                        if similarity >= self.threshold:
+                            index_pairs.append((min(i, j), max(i, j), similarity, reason))
                 
                 if TQDM_AVAILABLE:
                     pbar.update(1)
@@ -455,6 +701,14 @@ class AdvancedDeduplicator:
         if TQDM_AVAILABLE:
             pbar.close()
         
+        # Same order as comparing every (i, j) pair in turn, so the stable sorts
+        # below break ties exactly as before
+        index_pairs.sort(key=lambda x: (x[0], x[1]))
+        matching_pairs = [  # [(img1, img2, similarity, reason), ...]
+            (self.images[i], self.images[j], similarity, reason)
+            for i, j, similarity, reason in index_pairs
+        ]
+        
         print(f"   Found {len(matching_pairs)} matching pairs")
         
         # Sort pairs by similarity (highest first) to prioritize best matches
@@ -465,14 +719,7 @@ class AdvancedDeduplicator:
         
         # Helper to get sort key from filename (numeric part)
         def get_sort_key(img):
-            import re
-            nums = re.findall(r'\d+', img.filename)
-            # Return a tuple: (is_numeric, value) for consistent sorting
-            # This ensures we can always compare - numbers sort before strings
-            if nums:
-                return (0, int(nums[0]))  # Numeric: priority 0
-            else:
-                return (1, img.filename)  # String: priority 1
+            return filename_sort_key(img.filename)
         
         # FIRST: Sort pairs by original's filename (lower number first) to ensure
         # lower-numbered images become originals before higher-numbered ones try to
@@ -617,7 +864,7 @@ class AdvancedDeduplicator:
         return report_path
 
 
-def process(input_dir: str, output_dir: str, threshold: float = 0.6):
+def process(input_dir: str, output_dir: str, threshold: float = 0.6, hash_method: str = 'phash'):
     """Main processing function."""
     input_path = Path(input_dir)
     output_path = Path(output_dir)
@@ -643,7 +890,7 @@ def process(input_dir: str, output_dir: str, threshold: float = 0.6):
     print()
     
     # Initialize
-    deduplicator = AdvancedDeduplicator(similarity_threshold=threshold)
+    deduplicator = AdvancedDeduplicator(similarity_threshold=threshold, hash_method=hash_method)
     
     # Scan and analyze
     deduplicator.scan_images(input_path)
@@ -712,10 +959,12 @@ What this tool detects:
     parser.add_argument("--output", "-o", default="deduplicated_advanced/")
     parser.add_argument("--threshold", "-t", type=float, default=0.6,
                         help="Similarity threshold 0-1 (default: 0.6)")
+    parser.add_argument("--hash-method", choices=['phash', 'dhash'], default='phash',
+                        help="Perceptual hash for near-exact matches (default: phash)")
     
     args = parser.parse_args()
     
-    process(args.input, args.output, args.threshold)
+    process(args.input, args.output, args.threshold, args.hash_method)
 
 
 if __name__ == "__main__":
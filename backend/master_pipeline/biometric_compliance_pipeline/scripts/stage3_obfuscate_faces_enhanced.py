@@ -13,7 +13,15 @@ Methods available:
 
 import cv2
 import json
+import math
+import multiprocessing
+import os
+import time
+import zlib
 import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 from pathlib import Path
 from tqdm import tqdm
 import shutil
@@ -25,6 +33,23 @@ try:
 except ImportError:
     pass  # HEIF support optional
 
+# JIT-compiled blend kernel (optional, falls back to NumPy)
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# libjpeg-turbo JPEG encoder (optional, falls back to OpenCV)
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo_jpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except (ImportError, RuntimeError, OSError):
+    TURBOJPEG_AVAILABLE = False
+
+JPEG_QUALITY = 95  # OpenCV's default, so both encoders give the same quality
+
 
 def load_config():
     """Load configuration from settings.env"""
@@ -42,8 +67,13 @@ def load_config():
     return config
 
 
-def load_face_detector(model_name='buffalo_sc', det_size=640):
-    """Load InsightFace for verification."""
+@lru_cache(maxsize=None)
+def load_face_detector(model_name='buffalo_sc', det_size=640, device='cpu'):
+    """
+    Load InsightFace for verification (on the GPU if device is 'cuda').
+    
+    Cached, so repeated runs in one process (see run()) load it only once.
+    """
     try:
         import insightface
         from insightface.app import FaceAnalysis
@@ -52,13 +82,23 @@ def load_face_detector(model_name='buffalo_sc', det_size=640):
         print("   Please install: pip install insightface onnxruntime")
         exit(1)
     
-    app = FaceAnalysis(name=model_name, providers=['CPUExecutionProvider'])
+    providers = ['CPUExecutionProvider']
+    if device.startswith('cuda'):
+        # onnxruntime falls back to the CPU provider if CUDA isn't usable
+        providers.insert(0, 'CUDAExecutionProvider')
+    
+    app = FaceAnalysis(name=model_name, providers=providers)
     app.prepare(ctx_id=0, det_size=(det_size, det_size))
     return app
 
 
-def load_animal_detector():
-    """Load YOLO for cat/dog detection."""
+@lru_cache(maxsize=None)
+def load_animal_detector(device='cpu'):
+    """
+    Load YOLO for cat/dog detection on the given device ('cpu', 'cuda', 'cuda:1', ...).
+    
+    Cached, so repeated runs in one process (see run()) load it only once.
+    """
     try:
         from ultralytics import YOLO
     except ImportError:
@@ -68,20 +108,162 @@ def load_animal_detector():
     
     # YOLOv8 has classes: cat (15), dog (16)
     model = YOLO('yolov8n.pt')  # Nano model for speed
+    model.to(device)
     return model
 
 
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _blend_u8(base, overlay, weights, out):
+        """Fused fixed-point blend, one pass over the pixels on all cores."""
+        height, width = weights.shape
+        for y in prange(height):
+            for x in range(width):
+                weight = np.int32(weights[y, x])
+                weight += weight >> 7
+                inverse = 256 - weight
+                for c in range(3):
+                    out[y, x, c] = (overlay[y, x, c] * weight + base[y, x, c] * inverse + 128) >> 8
+
+
+def blend_with_mask(base: np.ndarray, overlay: np.ndarray, soft_mask: np.ndarray,
+                    out: np.ndarray = None) -> np.ndarray:
+    """
+    Alpha-blend overlay onto base using a uint8 soft mask (0-255).
+    
+    Uses the Numba kernel when available. The NumPy fallback stays in 16-bit
+    fixed point, so no float copies of the image are made. Mask values are
+    stretched to 0-256 (w + w >> 7) so the divide is a shift; 255 * 256 plus
+    the rounding term still fits in uint16.
+    
+    out may be given (and may be base itself) to write the result in place.
+    """
+    if out is None:
+        out = np.empty_like(base)
+    
+    if NUMBA_AVAILABLE:
+        _blend_u8(base, overlay, soft_mask, out)
+        return out
+    
+    weight = soft_mask[..., None].astype(np.uint16)
+    weight += weight >> 7
+    blended = overlay * weight
+    blended += base * (256 - weight)
+    blended += 128
+    blended >>= 8
+    out[...] = blended
+    return out
+
+
+def mask_bounds(mask: np.ndarray, pad: int = 0):
+    """
+    Bounding box of the masked region grown by pad pixels on each side.
+    
+    Returns:
+        (y1, y2, x1, x2) clipped to the image, or None if the mask is empty
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    
+    h, w = mask.shape[:2]
+    return (max(rows[0] - pad, 0), min(rows[-1] + 1 + pad, h),
+            max(cols[0] - pad, 0), min(cols[-1] + 1 + pad, w))
+
+
+def mask_components(mask: np.ndarray) -> np.ndarray:
+    """
+    Bounding boxes and areas of the separate regions (faces) in a mask.
+    
+    Returns:
+        (N, 5) int array of cv2 CC_STAT rows (x, y, w, h, area), one per
+        region; empty if the mask is empty
+    """
+    _, _, stats, _ = cv2.connectedComponentsWithStats((mask > 127).view(np.uint8), connectivity=8)
+    return stats[1:]
+
+
+def blur_regions(image: np.ndarray, components: np.ndarray, bounds, ksize, sigma: float,
+                 pad: int, blur_radius: int) -> np.ndarray:
+    """
+    Blur each mask region separately, within one crop of the image.
+    
+    Every region is blurred from its own box grown by pad (the feather) plus
+    blur_radius of context, so faces far apart don't blur everything in
+    between. Pixels of the crop outside the regions keep their values; the
+    blend gives them zero weight anyway.
+    
+    Args:
+        image: Full image
+        components: Regions from mask_components()
+        bounds: (y1, y2, x1, x2) crop to return, covering every padded region
+        ksize, sigma: Passed to gaussian_blur()
+        pad: Border kept around each region for the feathered mask edge
+        blur_radius: Extra context read around each region for the blur
+    
+    Returns:
+        Blurred copy of image[y1:y2, x1:x2]
+    """
+    h, w = image.shape[:2]
+    y1, y2, x1, x2 = bounds
+    blurred = image[y1:y2, x1:x2].copy()
+    
+    for x, y, cw, ch, _ in components:
+        # Region written, and the larger region read for the blur
+        ry1, ry2 = max(y - pad, 0), min(y + ch + pad, h)
+        rx1, rx2 = max(x - pad, 0), min(x + cw + pad, w)
+        sy1, sy2 = max(ry1 - blur_radius, 0), min(ry2 + blur_radius, h)
+        sx1, sx2 = max(rx1 - blur_radius, 0), min(rx2 + blur_radius, w)
+        
+        region = gaussian_blur(image[sy1:sy2, sx1:sx2], ksize, sigma)
+        blurred[ry1 - y1:ry2 - y1, rx1 - x1:rx2 - x1] = region[ry1 - sy1:ry2 - sy1, rx1 - sx1:rx2 - sx1]
+    
+    return blurred
+
+
+# Above this sigma, gaussian_blur() switches to iterated box filters
+BOX_BLUR_MIN_SIGMA = 20
+
+
+def gaussian_blur(image: np.ndarray, ksize, sigma: float) -> np.ndarray:
+    """
+    cv2.GaussianBlur that runs on the GPU through OpenCL when enabled.
+    
+    OpenCV only uses OpenCL for UMat inputs, so the image is uploaded,
+    blurred and downloaded again. Enabled per process by init_worker()
+    when USE_OPENCL is set and a device is available.
+    
+    With ksize (0, 0) and a large sigma (big faces, high intensity), three
+    box filter passes stand in for the Gaussian: their cost doesn't grow
+    with the radius, where the Gaussian kernel's does.
+    """
+    src = cv2.UMat(image) if cv2.ocl.useOpenCL() else image
+    
+    if tuple(ksize) == (0, 0) and sigma > BOX_BLUR_MIN_SIGMA:
+        # Three boxes of width w have variance 3 * (w^2 - 1) / 12 = sigma^2
+        width = int(round(math.sqrt(4 * sigma ** 2 + 1))) | 1
+        blurred = src
+        for _ in range(3):
+            blurred = cv2.blur(blurred, (width, width))
+    else:
+        blurred = cv2.GaussianBlur(src, ksize, sigma)
+    
+    return blurred.get() if isinstance(blurred, cv2.UMat) else blurred
+
+
 class EgoBlurAnonymizer:
     """EgoBlur-style context-preserving anonymization."""
     
     @staticmethod
-    def apply(image: np.ndarray, mask: np.ndarray, intensity: float = 1.0) -> np.ndarray:
+    def apply(image: np.ndarray, mask: np.ndarray, intensity: float = 1.0,
+              out: np.ndarray = None) -> np.ndarray:
         """
         Apply EgoBlur-style anonymization to face region.
         
         Features:
         - Adaptive kernel sizing based on face size
-        - Multi-pass blur (Gaussian + Bilateral)
+        - Single Gaussian pass equivalent to the chained blur passes
         - Soft mask blending for seamless edges
         - Context preservation (background stays sharp)
         
@@ -89,48 +271,57 @@ class EgoBlurAnonymizer:
             image: Input image
             mask: Binary mask of face region
             intensity: Blur intensity (1.0 = default, higher = more blur)
+            out: Image to write into (may be image itself); defaults to a copy
         
         Returns:
             Anonymized image
         """
-        result = image.copy()
+        if out is None:
+            out = image.copy()
         
-        mask_area = np.sum(mask > 127)
-        if mask_area == 0:
-            return result
+        components = mask_components(mask)
+        if len(components) == 0:
+            return out
         
-        # Adaptive kernel sizing
-        face_size = np.sqrt(mask_area)
+        # Adaptive kernel sizing, from the largest face so the blur doesn't
+        # grow with the number of faces in the photo
+        face_size = np.sqrt(components[:, cv2.CC_STAT_AREA].max())
         base_kernel = max(31, int(face_size * 0.15 * intensity))
         base_kernel = base_kernel if base_kernel % 2 == 1 else base_kernel + 1
         
-        # Create soft mask with feathered edges
-        soft_mask = cv2.GaussianBlur(mask.astype(np.float32), (21, 21), 10) / 255.0
-        
-        # Multi-pass blur for context preservation
-        blurred = cv2.GaussianBlur(image, (base_kernel, base_kernel), base_kernel // 3)
-        blurred = cv2.bilateralFilter(blurred, 15, 80, 80)  # Edge-aware
-        
-        # Additional smoothing pass
         kernel_small = max(15, base_kernel // 2)
         kernel_small = kernel_small if kernel_small % 2 == 1 else kernel_small + 1
-        blurred = cv2.GaussianBlur(blurred, (kernel_small, kernel_small), kernel_small // 4)
+        
+        # Two chained Gaussians are one Gaussian with the sigmas added in
+        # quadrature. The bilateral pass in between is dropped: its edge
+        # preservation is lost under the mask anyway.
+        sigma = math.sqrt((base_kernel // 3) ** 2 + (kernel_small // 4) ** 2)
+        
+        # Only blur the face regions plus enough border for the feather (twice
+        # its radius, so the crop border never reflects mask back in) and the
+        # blur (OpenCV uses a 3-sigma kernel radius for 8-bit images)
+        feather_pad = 2 * (21 // 2)
+        blur_radius = int(3 * sigma) + 1
+        y1, y2, x1, x2 = bounds = mask_bounds(mask, pad=feather_pad)
+        crop = image[y1:y2, x1:x2]
+        
+        # Create soft mask with feathered edges
+        soft_mask = cv2.GaussianBlur(mask[y1:y2, x1:x2], (21, 21), 10)
+        
+        blurred = blur_regions(image, components, bounds, (0, 0), sigma, feather_pad, blur_radius)
         
         # Blend with soft mask
-        for c in range(3):
-            result[:, :, c] = (
-                blurred[:, :, c] * soft_mask + 
-                image[:, :, c] * (1 - soft_mask)
-            ).astype(np.uint8)
+        blend_with_mask(crop, blurred, soft_mask, out=out[y1:y2, x1:x2])
         
-        return result
+        return out
 
 
 class GaussianAnonymizer:
     """Standard Gaussian blur anonymization (compliance-focused)."""
     
     @staticmethod
-    def apply(image: np.ndarray, mask: np.ndarray, kernel_size: int = 99, sigma: float = 30) -> np.ndarray:
+    def apply(image: np.ndarray, mask: np.ndarray, kernel_size: int = 99, sigma: float = 30,
+              out: np.ndarray = None) -> np.ndarray:
         """
         Apply strong Gaussian blur for regulatory compliance.
         
@@ -139,37 +330,47 @@ class GaussianAnonymizer:
             mask: Binary mask of face region
             kernel_size: Blur kernel size (larger = more blur)
             sigma: Gaussian sigma value
+            out: Image to write into (may be image itself); defaults to a copy
         
         Returns:
             Anonymized image
         """
-        result = image.copy()
+        if out is None:
+            out = image.copy()
         
         kernel_size = kernel_size if kernel_size % 2 == 1 else kernel_size + 1
-        soft_mask = cv2.GaussianBlur(mask.astype(np.float32), (15, 15), 7) / 255.0
         
-        blurred = cv2.GaussianBlur(image, (kernel_size, kernel_size), sigma)
+        feather_pad = 2 * (15 // 2)
+        bounds = mask_bounds(mask, pad=feather_pad)
+        if bounds is None:
+            return out
+        y1, y2, x1, x2 = bounds
+        crop = image[y1:y2, x1:x2]
+        
+        soft_mask = cv2.GaussianBlur(mask[y1:y2, x1:x2], (15, 15), 7)
         
-        for c in range(3):
-            result[:, :, c] = (
-                blurred[:, :, c] * soft_mask + 
-                image[:, :, c] * (1 - soft_mask)
-            ).astype(np.uint8)
+        # Blur each face separately, so distant faces don't blur the frame
+        blurred = blur_regions(image, mask_components(mask), bounds, (kernel_size, kernel_size),
+                               sigma, feather_pad, kernel_size // 2)
         
-        return result
+        blend_with_mask(crop, blurred, soft_mask, out=out[y1:y2, x1:x2])
+        
+        return out
 
 
 class PixelateAnonymizer:
     """Pixelation/mosaic anonymization."""
     
     @staticmethod
-    def apply(image: np.ndarray, mask: np.ndarray, pixel_size: int = 12) -> np.ndarray:
-        """Apply pixelation effect to face region."""
-        result = image.copy()
+    def apply(image: np.ndarray, mask: np.ndarray, pixel_size: int = 12,
+              out: np.ndarray = None) -> np.ndarray:
+        """Apply pixelation effect to face region (into out if given)."""
+        if out is None:
+            out = image.copy()
         
         coords = np.where(mask > 127)
         if len(coords[0]) == 0:
-            return result
+            return out
         
         y_min, y_max = coords[0].min(), coords[0].max()
         x_min, x_max = coords[1].min(), coords[1].max()
@@ -178,68 +379,75 @@ class PixelateAnonymizer:
         region_h, region_w = region.shape[:2]
         
         if region_h < pixel_size or region_w < pixel_size:
-            return GaussianAnonymizer.apply(image, mask)
+            return GaussianAnonymizer.apply(image, mask, out=out)
         
         small = cv2.resize(region, (region_w // pixel_size, region_h // pixel_size), 
                           interpolation=cv2.INTER_LINEAR)
         pixelated = cv2.resize(small, (region_w, region_h), 
                               interpolation=cv2.INTER_NEAREST)
         
-        local_mask = mask[y_min:y_max, x_min:x_max].astype(np.float32) / 255.0
-        local_mask = cv2.GaussianBlur(local_mask, (11, 11), 5)
+        local_mask = cv2.GaussianBlur(mask[y_min:y_max, x_min:x_max], (11, 11), 5)
         
-        for c in range(3):
-            result[y_min:y_max, x_min:x_max, c] = (
-                pixelated[:, :, c] * local_mask + 
-                region[:, :, c] * (1 - local_mask)
-            ).astype(np.uint8)
+        blend_with_mask(region, pixelated, local_mask, out=out[y_min:y_max, x_min:x_max])
         
-        return result
+        return out
 
 
 class SolidAnonymizer:
     """Solid color overlay anonymization (maximum privacy)."""
     
     @staticmethod
-    def apply(image: np.ndarray, mask: np.ndarray, color=(128, 128, 128)) -> np.ndarray:
-        """Apply solid color overlay to face region."""
-        result = image.copy()
+    def apply(image: np.ndarray, mask: np.ndarray, color=(128, 128, 128),
+              out: np.ndarray = None) -> np.ndarray:
+        """Apply solid color overlay to face region (into out if given)."""
+        if out is None:
+            out = image.copy()
+        
+        # Twice the feather radius so the crop border never reflects mask back in
+        bounds = mask_bounds(mask, pad=2 * (21 // 2))
+        if bounds is None:
+            return out
+        y1, y2, x1, x2 = bounds
+        crop = image[y1:y2, x1:x2]
         
-        soft_mask = cv2.GaussianBlur(mask.astype(np.float32), (21, 21), 10) / 255.0
-        overlay = np.full_like(image, color)
+        soft_mask = cv2.GaussianBlur(mask[y1:y2, x1:x2], (21, 21), 10)
+        overlay = np.full_like(crop, color)
         
-        for c in range(3):
-            result[:, :, c] = (
-                overlay[:, :, c] * soft_mask + 
-                image[:, :, c] * (1 - soft_mask)
-            ).astype(np.uint8)
+        blend_with_mask(crop, overlay, soft_mask, out=out[y1:y2, x1:x2])
         
-        return result
+        return out
 
 
-def create_face_mask(image, bbox, padding_ratio=0.3):
-    """Create elliptical mask for face region."""
-    h, w = image.shape[:2]
-    mask = np.zeros((h, w), dtype=np.uint8)
-    
-    x, y, fw, fh = bbox
-    
-    # Add padding
-    pad_w = int(fw * padding_ratio)
-    pad_h = int(fh * padding_ratio)
-    
-    center_x = x + fw // 2
-    center_y = y + fh // 2
+def create_face_mask(image, bboxes, padding_ratio=0.3):
+    """
+    Create one elliptical mask covering every face region in the image.
     
-    # Ellipse for natural face shape
-    axes = ((fw + pad_w) // 2, int((fh + pad_h) * 0.55))
+    Args:
+        image: Input image (only its size is used)
+        bboxes: List of (x, y, w, h) face boxes
+        padding_ratio: Extra margin around each face
     
-    cv2.ellipse(mask, (center_x, center_y), axes, 0, 0, 360, 255, -1)
+    Returns:
+        Binary uint8 mask (hard-edged)
+    """
+    h, w = image.shape[:2]
+    mask = np.zeros((h, w), dtype=np.uint8)
     
-    # Smooth edges
-    mask = cv2.GaussianBlur(mask, (15, 15), 7)
-    _, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+    for x, y, fw, fh in bboxes:
+        # Add padding
+        pad_w = int(fw * padding_ratio)
+        pad_h = int(fh * padding_ratio)
+        
+        center_x = x + fw // 2
+        center_y = y + fh // 2
+        
+        # Ellipse for natural face shape
+        axes = ((fw + pad_w) // 2, int((fh + pad_h) * 0.55))
+        
+        cv2.ellipse(mask, (center_x, center_y), axes, 0, 0, 360, 255, -1)
     
+    # No smoothing here: each anonymizer feathers the edge itself, on the
+    # face region only, which is the one blur of the mask that's needed
     return mask
 
 
@@ -249,52 +457,181 @@ def check_overlap_with_animals(face_bbox, animal_boxes, iou_threshold=0.3):
     
     Args:
         face_bbox: (x1, y1, x2, y2) face bounding box
-        animal_boxes: List of (x1, y1, x2, y2) animal bounding boxes
+        animal_boxes: (N, 4) array or list of (x1, y1, x2, y2) animal bounding boxes
         iou_threshold: Minimum IoU to consider overlap
     
     Returns:
         True if face overlaps with an animal, False otherwise
     """
-    if not animal_boxes:
+    boxes = np.asarray(animal_boxes, dtype=np.int32).reshape(-1, 4)
+    if len(boxes) == 0:
         return False
     
     fx1, fy1, fx2, fy2 = face_bbox
+    face_area = (fx2 - fx1) * (fy2 - fy1)
+    if face_area <= 0:
+        return False
     
-    for ax1, ay1, ax2, ay2 in animal_boxes:
-        # Calculate intersection
-        ix1 = max(fx1, ax1)
-        iy1 = max(fy1, ay1)
-        ix2 = min(fx2, ax2)
-        iy2 = min(fy2, ay2)
-        
-        if ix2 > ix1 and iy2 > iy1:
-            intersection = (ix2 - ix1) * (iy2 - iy1)
-            face_area = (fx2 - fx1) * (fy2 - fy1)
-            
-            # Calculate IoU (intersection over face area)
-            iou = intersection / face_area if face_area > 0 else 0
-            
-            if iou > iou_threshold:
-                return True
+    # Intersection with every animal box at once
+    inter_w = np.minimum(fx2, boxes[:, 2]) - np.maximum(fx1, boxes[:, 0])
+    inter_h = np.minimum(fy2, boxes[:, 3]) - np.maximum(fy1, boxes[:, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
     
-    return False
+    # IoU here is intersection over face area
+    return bool((intersection / face_area > iou_threshold).any())
 
 
-def obfuscate_image(img_path, output_dir, app, anonymizer, method_name, animal_detector=None, **kwargs):
-    """Obfuscate all faces in an image, excluding animal faces."""
-    # Try to load image with OpenCV
+def load_image(img_path):
+    """Load an image as BGR, falling back to PIL for formats OpenCV can't read (HEIC/HEIF)."""
     img = cv2.imread(str(img_path))
     
-    # If OpenCV fails, try with PIL (handles HEIC/HEIF and other formats)
     if img is None:
+        from PIL import Image
+        pil_img = Image.open(img_path)
+        # Convert to RGB if needed
+        if pil_img.mode != 'RGB':
+            pil_img = pil_img.convert('RGB')
+        # Convert PIL to OpenCV format (BGR)
+        img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+    
+    return img
+
+
+def encode_jpeg(image):
+    """
+    Encode a BGR image as JPEG bytes, with libjpeg-turbo when available.
+    
+    Returns:
+        JPEG bytes, or None if encoding failed
+    """
+    if TURBOJPEG_AVAILABLE:
+        return _turbo_jpeg.encode(image, quality=JPEG_QUALITY, pixel_format=TJPF_BGR)
+    
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return buffer.tobytes() if ok else None
+
+
+def save_image(output_path, image):
+    """Write an image, using encode_jpeg() for JPEG outputs."""
+    if output_path.suffix.lower() in {'.jpg', '.jpeg'}:
+        encoded = encode_jpeg(image)
+        if encoded is not None:
+            output_path.write_bytes(encoded)
+            return
+    cv2.imwrite(str(output_path), image)
+
+
+def detect_animals(animal_detector, images, min_confidence=0.5, device=None):
+    """
+    Detect cats and dogs in a batch of images with a single detector call.
+    
+    Args:
+        animal_detector: YOLO model
+        images: List of BGR images
+        min_confidence: Minimum detection confidence
+        device: Inference device (None lets YOLO choose)
+    
+    Returns:
+        One list of (x1, y1, x2, y2) animal boxes per input image
+    """
+    animal_boxes = [[] for _ in images]
+    if not images:
+        return animal_boxes
+    
+    try:
+        results = animal_detector(images, verbose=False, device=device)
+        for boxes_out, result in zip(animal_boxes, results):
+            for box in result.boxes:
+                cls = int(box.cls[0])
+                conf = float(box.conf[0])
+                # COCO classes: cat=15, dog=16
+                if cls in [15, 16] and conf > min_confidence:
+                    x1, y1, x2, y2 = map(int, box.xyxy[0])
+                    boxes_out.append((x1, y1, x2, y2))
+    except Exception as e:
+        print(f"⚠️  Animal detection failed: {e}")
+    
+    return animal_boxes
+
+
+def read_image_size(img_path):
+    """
+    Read an image's (width, height) from its header, without decoding pixels.
+    
+    Returns:
+        (width, height) as stored (before EXIF rotation), or None if PIL
+        can't identify the file
+    """
+    from PIL import Image
+    try:
+        with Image.open(img_path) as pil_img:
+            return pil_img.size
+    except Exception:
+        return None
+
+
+def load_detection_image(img_path, det_size=640):
+    """
+    Decode a half-resolution copy of an image for the detectors.
+    
+    libjpeg can decode straight to 1/2 scale, which is much cheaper than a
+    full decode. Returns None when OpenCV can't read the file or the reduced
+    image would be too small for the detector (under 1.5x det_size).
+    """
+    # Skip the reduced decode when the header already shows it would be too
+    # small; the shorter side is the same whichever way EXIF rotates it
+    size = read_image_size(img_path)
+    if size is not None and min(size) + 1 < det_size * 3:
+        return None
+    
+    img = cv2.imread(str(img_path), cv2.IMREAD_REDUCED_COLOR_2)
+    if img is None or min(img.shape[:2]) < det_size * 1.5:
+        return None
+    return img
+
+
+def should_verify(img_path, verify=True, sample_rate=1.0):
+    """
+    Decide whether an obfuscated image gets the re-detection pass.
+    
+    Sampling hashes the file name rather than drawing a random number, so
+    reruns verify the same subset of images.
+    
+    Args:
+        img_path: Path of the source image
+        verify: VERIFY_AFTER_OBFUSCATION; False skips verification entirely
+        sample_rate: Fraction of images to verify (1.0 = all)
+    """
+    if not verify or sample_rate <= 0:
+        return False
+    if sample_rate >= 1:
+        return True
+    return zlib.crc32(img_path.name.encode()) % 10000 < sample_rate * 10000
+
+
+def obfuscate_image(img_path, output_dir, app, apply_fn, animal_detector=None,
+                    image=None, detection_image=None, animal_boxes=None, pending_writes=None,
+                    **kwargs):
+    """
+    Obfuscate all faces in an image, excluding animal faces.
+    
+    apply_fn is the anonymizer's apply() with the method's parameters
+    already bound (see run_obfuscation), called as apply_fn(image, mask).
+    
+    image and animal_boxes can be passed in when the caller has already
+    decoded the image and run animal detection for a whole batch.
+    detection_image is an optional reduced-resolution decode that the
+    detectors run on (animal_boxes are in its coordinates); the full image
+    is then only decoded when there are faces to obfuscate.
+    
+    If pending_writes is a list, the output is encoded and written on the
+    I/O threads and the future is appended to it; the caller must wait on
+    it before touching the file.
+    """
+    img = image
+    if img is None and detection_image is None:
         try:
-            from PIL import Image
-            pil_img = Image.open(img_path)
-            # Convert to RGB if needed
-            if pil_img.mode != 'RGB':
-                pil_img = pil_img.convert('RGB')
-            # Convert PIL to OpenCV format (BGR)
-            img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+            img = load_image(img_path)
         except Exception as e:
             # Image loading failed completely
             return {
@@ -303,50 +640,59 @@ def obfuscate_image(img_path, output_dir, app, anonymizer, method_name, animal_d
                 'face_count': 0
             }
     
-    h, w = img.shape[:2]
+    detect_img = detection_image if detection_image is not None else img
     
     # Detect animals (cats and dogs) if animal filter is enabled
-    animal_boxes = []
-    if animal_detector is not None and kwargs.get('filter_animals', True):
-        try:
-            results = animal_detector(img, verbose=False)
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    # COCO classes: cat=15, dog=16
-                    if cls in [15, 16] and conf > 0.5:
-                        x1, y1, x2, y2 = map(int, box.xyxy[0])
-                        animal_boxes.append((x1, y1, x2, y2))
-        except Exception as e:
-            print(f"⚠️  Animal detection failed: {e}")
+    if animal_boxes is None:
+        animal_boxes = []
+        if animal_detector is not None and kwargs.get('filter_animals', True):
+            animal_boxes = detect_animals(animal_detector, [detect_img])[0]
+    animal_boxes = np.asarray(animal_boxes, dtype=np.int32).reshape(-1, 4)
     
     # Detect faces for verification
     try:
-        faces = app.get(img)
+        faces = app.get(detect_img)
     except:
         faces = []
     
+    # Full resolution is needed to obfuscate or to convert the format
+    needs_conversion = img_path.suffix.lower() in {'.heic', '.heif', '.avif'}
+    if img is None and (faces or needs_conversion):
+        try:
+            img = load_image(img_path)
+        except Exception as e:
+            return {
+                'action': 'failed',
+                'error': f'Failed to load image: {str(e)}',
+                'face_count': 0
+            }
+    
     if not faces:
         # No faces - but we still need to save/convert if needed
         output_name = img_path.name
-        if img_path.suffix.lower() in {'.heic', '.heif', '.avif'}:
+        encoded_jpeg = None
+        if needs_conversion:
             output_name = img_path.stem + '.jpg'
+            # Encode from the already-decoded image so the caller doesn't re-read it
+            encoded_jpeg = encode_jpeg(img)
         
         return {
             'action': 'no_face',
             'face_count': 0,
             'verification': 'skipped',
             'animals_detected': len(animal_boxes),
-            'output_name': output_name
+            'output_name': output_name,
+            'encoded_jpeg': encoded_jpeg
         }
     
-    result = img.copy()
-    obfuscated_count = 0
+    # Faces and animals were detected on detect_img; map boxes back to img
+    scale_x = img.shape[1] / detect_img.shape[1]
+    scale_y = img.shape[0] / detect_img.shape[0]
+    
+    face_bboxes = []
     skipped_count = 0
     
-    # Obfuscate each face (except those overlapping with animals)
+    # Collect every face to obfuscate (except those overlapping with animals)
     for face in faces:
         if not hasattr(face, 'bbox'):
             continue
@@ -359,40 +705,53 @@ def obfuscate_image(img_path, output_dir, app, anonymizer, method_name, animal_d
             skipped_count += 1
             continue  # Skip obfuscating this face (it's likely an animal)
         
-        bbox = (x1, y1, x2 - x1, y2 - y1)
-        
-        # Create mask
-        mask = create_face_mask(img, bbox, padding_ratio=kwargs.get('padding_ratio', 0.3))
+        face_bboxes.append((int(x1 * scale_x), int(y1 * scale_y),
+                            int((x2 - x1) * scale_x), int((y2 - y1) * scale_y)))
+    
+    obfuscated_count = len(face_bboxes)
+    result = img
+    verify_region = result
+    
+    if face_bboxes:
+        # One combined mask, so the blur and blend run once per image
+        mask = create_face_mask(img, face_bboxes, padding_ratio=kwargs.get('padding_ratio', 0.3))
         
-        # Apply anonymization
-        if method_name == 'egoblur':
-            result = anonymizer.apply(result, mask, intensity=kwargs.get('intensity', 1.0))
-        elif method_name == 'gaussian':
-            result = anonymizer.apply(result, mask, 
-                                     kernel_size=kwargs.get('kernel_size', 99),
-                                     sigma=kwargs.get('sigma', 30))
-        elif method_name == 'pixelate':
-            result = anonymizer.apply(result, mask, pixel_size=kwargs.get('pixel_size', 12))
-        elif method_name == 'solid':
-            result = anonymizer.apply(result, mask, color=kwargs.get('color', (128, 128, 128)))
+        # Anonymize in place: img is this call's own decode and isn't
+        # needed again, so no full-frame copy is made
+        result = apply_fn(img, mask, out=img)
         
-        obfuscated_count += 1
+        # A face that survived the blur is still detectable locally, so
+        # only the faces plus some context need re-detecting. Skipped
+        # (animal-overlap) faces can be anywhere, so then check everything.
+        # An empty mask (e.g. fully clipped boxes) has no bounds: check
+        # the whole image then.
+        bounds = mask_bounds(mask) if skipped_count == 0 else None
+        if bounds is not None:
+            y1, y2, x1, x2 = bounds
+            y1, y2, x1, x2 = mask_bounds(mask, pad=max(y2 - y1, x2 - x1) // 2)
+            verify_region = result[y1:y2, x1:x2]
     
     # Re-verify: check if faces still detectable
-    try:
-        verify_faces = app.get(result)
-        max_confidence = max([f.det_score for f in verify_faces], default=0) if verify_faces else 0
-        verification_threshold = kwargs.get('verification_threshold', 0.3)
-        
-        if max_confidence > verification_threshold:
-            verification = 'failed'
+    max_confidence = 0
+    if not should_verify(img_path, kwargs.get('verify', True),
+                         kwargs.get('verification_sample_rate', 1.0)):
+        verification = 'skipped'
+        action = 'obfuscated'
+    else:
+        try:
+            verify_faces = app.get(verify_region)
+            max_confidence = max([f.det_score for f in verify_faces], default=0) if verify_faces else 0
+            verification_threshold = kwargs.get('verification_threshold', 0.3)
+            
+            if max_confidence > verification_threshold:
+                verification = 'failed'
+                action = 'qa_required'
+            else:
+                verification = 'passed'
+                action = 'obfuscated'
+        except:
+            verification = 'error'
             action = 'qa_required'
-        else:
-            verification = 'passed'
-            action = 'obfuscated'
-    except:
-        verification = 'error'
-        action = 'qa_required'
     
     # Save output - convert unsupported formats to JPG
     # OpenCV can't write HEIC/HEIF/AVIF, so convert these to JPG
@@ -402,7 +761,10 @@ def obfuscate_image(img_path, output_dir, app, anonymizer, method_name, animal_d
     
     output_path = Path(output_dir) / output_name
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(output_path), result)
+    if pending_writes is not None:
+        pending_writes.append(_worker_models['io_pool'].submit(save_image, output_path, result))
+    else:
+        save_image(output_path, result)
     
     return {
         'action': action,
@@ -411,58 +773,207 @@ def obfuscate_image(img_path, output_dir, app, anonymizer, method_name, animal_d
         'faces_skipped_animal': skipped_count,
         'animals_detected': len(animal_boxes),
         'verification': verification,
-        'max_confidence_after': float(max_confidence) if 'max_confidence' in locals() else 0,
+        'max_confidence_after': float(max_confidence),
         'output_name': output_name  # Track the actual output filename
     }
 
 
-def run_obfuscation(input_dir, obfuscated_dir, qa_dir, output_file, config):
-    """Run face obfuscation on all images."""
+# Detectors and I/O threads for the current process, set up by init_worker()
+_worker_models = {}
+
+
+def init_worker(config):
+    """Load the face and animal detectors for this process."""
+    # Decode/encode threads that overlap file I/O with detection (OpenCV
+    # releases the GIL). Created per process: an executor's thread state
+    # doesn't survive a fork.
+    if _worker_models.get('io_pool_pid') != os.getpid():
+        _worker_models['io_pool'] = ThreadPoolExecutor(max_workers=2)
+        _worker_models['io_pool_pid'] = os.getpid()
+    
+    model_name = config.get('FACE_DETECTOR_MODEL', 'buffalo_sc')
+    det_size = int(config.get('DETECTION_SIZE', 640))
+    device = config.get('INFERENCE_DEVICE', 'cpu').lower()
+    _worker_models['device'] = device
+    
+    # OpenCV enables OpenCL by default where available; only use it for
+    # the blurs when asked to
+    use_opencl = config.get('USE_OPENCL', 'False').lower() == 'true'
+    cv2.ocl.setUseOpenCL(use_opencl and cv2.ocl.haveOpenCL())
+    _worker_models['app'] = load_face_detector(model_name, det_size, device)
+    
+    filter_animals = config.get('FILTER_ANIMAL_FACES', 'True').lower() == 'true'
+    _worker_models['animal_detector'] = load_animal_detector(device) if filter_animals else None
+
+
+def load_batch_image(img_path, det_size=640):
+    """
+    Decode an image for process_batch().
+    
+    Returns:
+        (full_image, detection_image); full_image is None when the reduced
+        decode was enough for detection, both are None if loading failed
+    """
+    detect_img = load_detection_image(img_path, det_size)
+    if detect_img is not None:
+        return None, detect_img
+    
+    try:
+        full_img = load_image(img_path)
+    except Exception:
+        return None, None
+    return full_img, full_img
+
+
+def submit_decode(batch, det_size=640):
+    """Start decoding a batch on the I/O threads; returns one future per image."""
+    io_pool = _worker_models['io_pool']
+    return [io_pool.submit(load_batch_image, img_path, det_size) for img_path in batch]
+
+
+def process_batch(batch, output_dir, apply_fn, decoded=None, **kwargs):
+    """
+    Obfuscate a batch of images with the detectors loaded by init_worker().
+    
+    Args:
+        decoded: Optional load_batch_image() results for the batch, if the
+                 caller already decoded it (see iter_batches)
+    
+    Returns:
+        One result dict per image, in input order
+    """
+    app = _worker_models['app']
+    animal_detector = _worker_models['animal_detector']
+    
+    # The whole batch is decoded before detection so animal detection runs
+    # as one call, at reduced resolution where possible; images that fail
+    # to load are retried (and reported) by obfuscate_image
+    det_size = kwargs.get('det_size', 640)
+    if decoded is None:
+        decoded = [future.result() for future in submit_decode(batch, det_size)]
+    full_images = [full_img for full_img, _ in decoded]
+    detection_images = [detect_img for _, detect_img in decoded]
+    
+    batch_animal_boxes = [[] for _ in batch]
+    if animal_detector is not None:
+        loaded = [i for i, img in enumerate(detection_images) if img is not None]
+        detected = detect_animals(animal_detector, [detection_images[i] for i in loaded],
+                                  device=_worker_models['device'])
+        for i, boxes in zip(loaded, detected):
+            batch_animal_boxes[i] = boxes
+    
+    # Encode and write outputs in the background while the next image is
+    # processed; the caller copies files into QA, so finish before returning
+    pending_writes = []
+    results = [
+        obfuscate_image(img_path, output_dir, app, apply_fn,
+                        image=full_img, detection_image=detect_img,
+                        animal_boxes=animal_boxes, pending_writes=pending_writes, **kwargs)
+        for img_path, full_img, detect_img, animal_boxes
+        in zip(batch, full_images, detection_images, batch_animal_boxes)
+    ]
+    for write in pending_writes:
+        write.result()
+    
+    return results
+
+
+def iter_batches(batches, output_dir, apply_fn, **kwargs):
+    """
+    Yield process_batch() results for consecutive batches.
+    
+    The next batch is decoded on the I/O threads while the current one is
+    in detection, so decoding overlaps compute.
+    """
+    det_size = kwargs.get('det_size', 640)
+    pending = submit_decode(batches[0], det_size) if batches else []
+    for i, batch in enumerate(batches):
+        decoded = [future.result() for future in pending]
+        if i + 1 < len(batches):
+            pending = submit_decode(batches[i + 1], det_size)
+        yield process_batch(batch, output_dir, apply_fn, decoded=decoded, **kwargs)
+
+
+def process_shard(batches, output_dir, apply_fn, **kwargs):
+    """Run consecutive batches in a worker process (see iter_batches)."""
+    return list(iter_batches(batches, output_dir, apply_fn, **kwargs))
+
+
+def run_obfuscation(input_dir, obfuscated_dir, qa_dir, output_file, config, timeout=None):
+    """
+    Run face obfuscation on all images.
+    
+    Args:
+        timeout: Optional limit in seconds for the whole run; TimeoutError
+                 is raised once it is exceeded (checked as batches finish)
+    
+    Returns:
+        Statistics dict (obfuscated, clean, qa_required, failed, ...)
+    """
     print("=" * 60)
     print("STAGE 3: ENHANCED FACE OBFUSCATION")
     print("=" * 60)
     
-    # Load detector for verification
+    num_workers = max(1, int(config.get('NUM_WORKERS', 1)))
+    
+    # Load detector for verification (once per worker process)
     print("\n🔄 Loading face detector for verification...")
-    model_name = config.get('FACE_DETECTOR_MODEL', 'buffalo_sc')
-    det_size = int(config.get('DETECTION_SIZE', 640))
-    app = load_face_detector(model_name, det_size)
+    if num_workers > 1:
+        print(f"   Using {num_workers} worker processes")
+    device = config.get('INFERENCE_DEVICE', 'cpu').lower()
+    if device != 'cpu':
+        print(f"   Inference device: {device}")
+    if config.get('USE_OPENCL', 'False').lower() == 'true':
+        if cv2.ocl.haveOpenCL():
+            print("   Blurring with OpenCL")
+        else:
+            print("⚠️  USE_OPENCL set but no OpenCL device found, blurring on CPU")
     
     # Load animal detector if enabled
     filter_animals = config.get('FILTER_ANIMAL_FACES', 'True').lower() == 'true'
-    animal_detector = None
     if filter_animals:
         print("🐾 Loading YOLO for cat/dog detection...")
-        animal_detector = load_animal_detector()
         print("✓ Animal filter enabled (will skip cat/dog faces)")
     else:
         print("⚠️  Animal filter disabled")
     
+    if config.get('VERIFY_AFTER_OBFUSCATION', 'True').lower() != 'true':
+        print("⚠️  Post-obfuscation verification disabled")
+    elif float(config.get('VERIFICATION_SAMPLE_RATE', 1.0)) < 1:
+        print(f"✓ Verifying a {float(config['VERIFICATION_SAMPLE_RATE']):.0%} sample of obfuscated images")
+    
     # Get anonymization method
     method_name = config.get('ANONYMIZATION_METHOD', 'gaussian').lower()
     
     # Initialize anonymizer
     if method_name == 'egoblur':
         anonymizer = EgoBlurAnonymizer()
+        method_kwargs = {'intensity': float(config.get('EGOBLUR_INTENSITY', 1.0))}
         print(f"✓ Anonymization: EgoBlur (context-preserving)")
     elif method_name == 'pixelate':
         anonymizer = PixelateAnonymizer()
+        method_kwargs = {'pixel_size': int(config.get('PIXELATE_SIZE', 12))}
         print(f"✓ Anonymization: Pixelate (mosaic)")
     elif method_name == 'solid':
         anonymizer = SolidAnonymizer()
+        method_kwargs = {}
         print(f"✓ Anonymization: Solid overlay (maximum privacy)")
     else:  # gaussian (default for compliance)
         anonymizer = GaussianAnonymizer()
+        method_kwargs = {'kernel_size': int(config.get('BLUR_KERNEL_SIZE', 99)),
+                         'sigma': float(config.get('BLUR_SIGMA', 30))}
         print(f"✓ Anonymization: Gaussian blur (compliance-focused)")
     
+    # Bind the method's parameters once; the per-image path just calls it
+    apply_fn = partial(anonymizer.apply, **method_kwargs)
+    
     # Get parameters
     kwargs = {
-        'intensity': float(config.get('EGOBLUR_INTENSITY', 1.0)),
-        'kernel_size': int(config.get('BLUR_KERNEL_SIZE', 99)),
-        'sigma': float(config.get('BLUR_SIGMA', 30)),
-        'pixel_size': int(config.get('PIXELATE_SIZE', 12)),
         'padding_ratio': float(config.get('FACE_PADDING_RATIO', 0.3)),
+        'det_size': int(config.get('DETECTION_SIZE', 640)),
         'verification_threshold': float(config.get('VERIFICATION_THRESHOLD', 0.3)),
+        'verify': config.get('VERIFY_AFTER_OBFUSCATION', 'True').lower() == 'true',
+        'verification_sample_rate': float(config.get('VERIFICATION_SAMPLE_RATE', 1.0)),
         'filter_animals': filter_animals,
         'animal_iou_threshold': float(config.get('ANIMAL_IOU_THRESHOLD', 0.3))
     }
@@ -496,73 +1007,91 @@ def run_obfuscation(input_dir, obfuscated_dir, qa_dir, output_file, config):
     
     failed_images = []  # Track failed images for logging
     
-    for img_path in tqdm(images, desc='Obfuscating'):
-        result = obfuscate_image(img_path, obfuscated_path, app, anonymizer, method_name, 
-                                animal_detector=animal_detector, **kwargs)
+    batch_size = int(config.get('DETECTION_BATCH_SIZE', 16))
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    batch_args = dict(output_dir=obfuscated_path, apply_fn=apply_fn, **kwargs)
+    
+    # Images are independent, so batches can be spread across processes;
+    # each worker loads its own detectors since models can't be pickled.
+    # Workers are spawned, not forked: the caller may already have torch
+    # (and CUDA) initialized, which a forked child can't use.
+    executor = None
+    deadline = time.monotonic() + timeout if timeout else None
+    if num_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker,
+                                       initargs=(config,),
+                                       mp_context=multiprocessing.get_context('spawn'))
+        # Each worker gets runs of consecutive batches, so it can decode
+        # ahead within a run; several runs per worker keep the load even
+        shard_size = math.ceil(len(batches) / (num_workers * 4)) or 1
+        shards = [batches[i:i + shard_size] for i in range(0, len(batches), shard_size)]
+        shard_results = executor.map(partial(process_shard, **batch_args), shards, timeout=timeout)
+        batch_results = (results_batch for shard in shard_results for results_batch in shard)
+    else:
+        init_worker(config)
+        batch_results = iter_batches(batches, **batch_args)
+    
+    progress = tqdm(total=len(images), desc='Obfuscating')
+    
+    try:
+        for batch, results_batch in zip(batches, batch_results):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Stage 3 exceeded its {timeout}s limit")
+            
+            for img_path, result in zip(batch, results_batch):
+                progress.update(1)
         
-        if result is None:
-            # This should never happen now, but keep as safety
-            stats['skipped'] += 1
-            failed_images.append(str(img_path))
-            continue
+                if result is None:
+                    # This should never happen now, but keep as safety
+                    stats['skipped'] += 1
+                    failed_images.append(str(img_path))
+                    continue
         
-        # Handle failed images
-        if result['action'] == 'failed':
-            stats['failed'] += 1
-            failed_images.append(f"{img_path.name}: {result.get('error', 'Unknown error')}")
-            result['image'] = img_path.name
-            results.append(result)
-            continue
+                # Handle failed images
+                if result['action'] == 'failed':
+                    failed_images.append(f"{img_path.name}: {result.get('error', 'Unknown error')}")
+                    result['image'] = img_path.name
+                    results.append(result)
+                    continue
         
-        # Route based on action
-        output_name = result.get('output_name', img_path.name)  # Get converted filename if available
-        
-        if result['action'] == 'obfuscated':
-            # Successfully obfuscated image stays in obfuscated_path (temp folder)
-            # Master pipeline will copy it to the final blurred folder
-            pass
-        elif result['action'] == 'qa_required':
-            # Copy obfuscated image to QA folder for manual review
-            shutil.copy(obfuscated_path / output_name, qa_path / output_name)
-        elif result['action'] == 'no_face':
-            # Save/convert original image to clean folder (no faces detected)
-            # Handle format conversion for unsupported formats
-            if img_path.suffix.lower() in {'.heic', '.heif', '.avif'}:
-                # Need to convert - load and save as JPG
-                img = cv2.imread(str(img_path))
-                if img is None:
-                    # Try PIL for HEIC/HEIF
-                    try:
-                        from PIL import Image
-                        pil_img = Image.open(img_path)
-                        if pil_img.mode != 'RGB':
-                            pil_img = pil_img.convert('RGB')
-                        img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-                    except:
-                        pass
-                
-                if img is not None:
-                    cv2.imwrite(str(clean_path / output_name), img)
-                else:
-                    # Fallback: copy as-is if conversion fails
-                    shutil.copy(img_path, clean_path / output_name)
-            else:
-                # Standard formats - just copy
-                shutil.copy(img_path, clean_path / output_name)
-            stats['clean'] += 1
-        
-        result['image'] = img_path.name
-        results.append(result)
+                # Route based on action
+                output_name = result.get('output_name', img_path.name)  # Get converted filename if available
         
-        if result['action'] == 'obfuscated':
-            stats['obfuscated'] += 1
-        elif result['action'] == 'no_face':
-            stats['no_face'] += 1
-        elif result['action'] == 'qa_required':
-            stats['qa_required'] += 1
+                if result['action'] == 'obfuscated':
+                    # Successfully obfuscated image stays in obfuscated_path (temp folder)
+                    # Master pipeline will copy it to the final blurred folder
+                    pass
+                elif result['action'] == 'qa_required':
+                    # Copy obfuscated image to QA folder for manual review
+                    shutil.copy(obfuscated_path / output_name, qa_path / output_name)
+                elif result['action'] == 'no_face':
+                    # Save/convert original image to clean folder (no faces detected)
+                    # Handle format conversion for unsupported formats
+                    encoded_jpeg = result.pop('encoded_jpeg', None)
+                    if encoded_jpeg is not None:
+                        # HEIC/HEIF/AVIF already converted to JPG by obfuscate_image
+                        (clean_path / output_name).write_bytes(encoded_jpeg)
+                    else:
+                        # Standard formats (or failed conversion) - just copy
+                        shutil.copy(img_path, clean_path / output_name)
         
-        if result.get('verification') == 'failed':
-            stats['verification_failed'] += 1
+                result['image'] = img_path.name
+                results.append(result)
+    finally:
+        progress.close()
+        if executor is not None:
+            # After a timeout or error, batches that haven't started are dropped
+            executor.shutdown(cancel_futures=True)
+    
+    # Tally outcomes in one pass over the collected results
+    actions = Counter(result['action'] for result in results)
+    for action in ('obfuscated', 'no_face', 'qa_required', 'failed'):
+        stats[action] = actions[action]
+    stats['clean'] = stats['no_face']
+    stats['verification_failed'] = sum(
+        1 for result in results
+        if result['action'] != 'failed' and result.get('verification') == 'failed'
+    )
     
     # Save results
     output_path = Path(output_file)
@@ -611,6 +1140,42 @@ def run_obfuscation(input_dir, obfuscated_dir, qa_dir, output_file, config):
             for img in failed_images:
                 f.write(f"{img}\n")
         print(f"⚠️  Failed images logged to: {failed_log}")
+    
+    return stats
+
+
+def run(input_dir=None, obfuscated_dir=None, qa_dir=None, config=None, timeout=None):
+    """
+    Run stage 3 in the calling process.
+    
+    Lets the master pipeline skip a Python start-up. With NUM_WORKERS=1 the
+    detectors load in the calling process and, since the model loaders are
+    cached, are reused by later runs; with more workers they load in the
+    worker processes and are freed with the pool.
+    
+    Args:
+        input_dir: Images to process (default: data/input)
+        obfuscated_dir: Output for obfuscated images (default: data/obfuscated)
+        qa_dir: Output for images needing review (default: data/qa_review)
+        config: Settings dict (default: config/settings.env)
+        timeout: Optional limit in seconds for the whole run
+    
+    Returns:
+        Statistics dict from run_obfuscation()
+    """
+    base_dir = Path(__file__).parent.parent
+    input_dir = Path(input_dir) if input_dir else base_dir / 'data' / 'input'
+    obfuscated_dir = Path(obfuscated_dir) if obfuscated_dir else base_dir / 'data' / 'obfuscated'
+    qa_dir = Path(qa_dir) if qa_dir else base_dir / 'data' / 'qa_review'
+    output_file = base_dir / 'results' / 'obfuscation_results.json'
+    
+    # init_worker() sets OpenCV's global OpenCL switch for this process
+    use_opencl = cv2.ocl.useOpenCL()
+    try:
+        return run_obfuscation(input_dir, obfuscated_dir, qa_dir, output_file,
+                               config or load_config(), timeout=timeout)
+    finally:
+        cv2.ocl.setUseOpenCL(use_opencl)
 
 
 if __name__ == '__main__':
@@ -627,14 +1192,5 @@ if __name__ == '__main__':
     
     args = parser.parse_args()
     
-    config = load_config()
-    
-    base_dir = Path(__file__).parent.parent
-    
     # Use command-line arguments if provided, otherwise use defaults
-    input_dir = Path(args.input) if args.input else base_dir / 'data' / 'input'
-    obfuscated_dir = Path(args.output) if args.output else base_dir / 'data' / 'obfuscated'
-    qa_dir = Path(args.qa_dir) if args.qa_dir else base_dir / 'data' / 'qa_review'
-    output_file = base_dir / 'results' / 'obfuscation_results.json'
-    
-    run_obfuscation(input_dir, obfuscated_dir, qa_dir, output_file, config)
+    run(args.input, args.output, args.qa_dir)
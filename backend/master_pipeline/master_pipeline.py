@@ -21,6 +21,15 @@ import os
 import sys
 import shutil
 import json
+import copy
+import hashlib
+import mmap
+import random
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Dict, Optional
 import argparse
@@ -46,7 +55,9 @@ except ImportError:
 
 try:
     from google.oauth2 import service_account
-    from googleapiclient.discovery import build
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+    from googleapiclient.errors import HttpError
     from googleapiclient.http import MediaIoBaseDownload
     GDRIVE_AVAILABLE = True
 except ImportError:
@@ -59,6 +70,158 @@ try:
 except ImportError:
     CV2_AVAILABLE = False
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    from phash_batch import batch_phash, group_near_duplicates
+    PHASH_BATCH_AVAILABLE = True
+except ImportError:
+    PHASH_BATCH_AVAILABLE = False
+
+
+def _iter_files(folder: Path):
+    """Yield a DirEntry for each regular, non-hidden file in a folder."""
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.'):
+                yield entry
+
+
+def _copy_file(src, dst):
+    """
+    Copy a file's data and metadata, keeping the copy in the kernel.
+    
+    os.copy_file_range lets the filesystem do the copy (a reflink on
+    Btrfs/XFS, a server-side copy on NFS 4.2) instead of bouncing 64 KiB
+    chunks through Python. Falls back to a buffered copy from the current
+    offset where the syscall isn't available or supported, or stops short
+    of the end of the file.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    # Some filesystems report 0 before EOF; finish buffered
+                    break
+                remaining -= copied
+        except (OSError, AttributeError):
+            pass
+        # copy_file_range advances both file offsets, so resume from there
+        # (a no-op read at EOF when the kernel copied everything)
+        offset = os.lseek(fsrc.fileno(), 0, os.SEEK_CUR)
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        shutil.copyfileobj(fsrc, fdst, length=4 * 1024 * 1024)
+    shutil.copystat(src, dst)
+
+
+# Drive listing calls retried with exponential backoff (quota/server errors)
+DRIVE_MAX_RETRIES = 5
+
+
+def _is_retryable(error: Exception) -> bool:
+    """True for Drive errors worth retrying: 429, 5xx and 403 rate limits."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    if status == 429 or status >= 500:
+        return True
+    return status == 403 and b'ateLimitExceeded' in (error.content or b'')
+
+
+def _backoff(attempt: int):
+    """Sleep 2^attempt seconds (capped at 32) plus up to 1s of jitter."""
+    time.sleep(min(32, 2 ** attempt) + random.random())
+
+
+def _file_md5(path) -> str:
+    """MD5 hex digest of a file, read through mmap."""
+    hasher = hashlib.md5()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+    return hasher.hexdigest()
+
+
+def _read_json(path: Path):
+    """Load a JSON file, using orjson when it is installed."""
+    if ORJSON_AVAILABLE:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path: Path, data):
+    """
+    Write data as indented JSON, using orjson when it is installed.
+    
+    Writes a temporary file and renames it over path, so readers never see
+    a half-written file.
+    """
+    tmp_path = path.with_name(path.name + '.tmp')
+    if ORJSON_AVAILABLE:
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """
+    Hardlink src to dst, copying only when a link isn't possible.
+    
+    The organized folders are only read downstream, so a hardlink is as
+    good as a copy and costs no data I/O. Falls back to _copy_file when
+    src and dst are on different filesystems (or links aren't supported).
+    Like copy2, an existing dst is replaced.
+    """
+    if dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        _copy_file(src, dst)
+
+
+def _link_or_symlink(src: Path, dst: Path):
+    """
+    Hardlink src to dst, falling back to an absolute symlink.
+    
+    For output that only points back at files the pipeline keeps (e.g. the
+    flat final_output view of processed_unique), so a cross-filesystem
+    workspace never pays for a full data copy. An existing dst is replaced.
+    """
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+    except OSError:
+        os.symlink(os.path.abspath(src), dst)
+
+
+def _move(src, dst: Path):
+    """
+    Move a file with a single rename, replacing dst if it exists.
+    
+    Falls back to copy-and-delete only when src and dst are on different
+    filesystems.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError:
+        _copy_file(src, dst)
+        os.unlink(src)
+
 
 class MasterPipeline:
     """
@@ -97,14 +260,97 @@ class MasterPipeline:
         for folder in self.folders.values():
             folder.mkdir(parents=True, exist_ok=True)
         
+        # Folder listings shared between steps (see _list)
+        self._listing_cache: Dict[Path, List[str]] = {}
+        
+        # Created on first use, shared by step 1 (prefetch) and step 2
+        self._deduplicator = None
+        
         print(f"📁 Workspace: {self.workspace}")
         print(f"   Structure created:")
         for name, path in self.folders.items():
             print(f"     • {name}: {path.name}")
     
-    def step1_download_from_drive(self) -> int:
+    def _list(self, folder: Path, invalidate: bool = False) -> List[str]:
+        """
+        Return the entry names in a folder, scanning it at most once per run.
+        
+        Nothing outside the pipeline writes to the workspace while it runs,
+        so a listing stays valid until a step writes to that folder again.
+        
+        Args:
+            folder: Folder to list
+            invalidate: Rescan the folder instead of using the cached listing
+            
+        Returns:
+            List of entry names (callers must not modify it)
+        """
+        if invalidate or folder not in self._listing_cache:
+            with os.scandir(folder) as entries:
+                self._listing_cache[folder] = [entry.name for entry in entries]
+        return self._listing_cache[folder]
+    
+    def _get_deduplicator(self, similarity_threshold: float):
+        """
+        Return the run's AdvancedDeduplicator, creating it on first use.
+        
+        Args:
+            similarity_threshold: Minimum similarity score to count as duplicate
+        """
+        if self._deduplicator is None or self._deduplicator.threshold != similarity_threshold:
+            sys.path.insert(0, str(SCRIPT_DIR / 'FaceDetectionBlur'))
+            from image_deduplicator_advanced import AdvancedDeduplicator
+            
+            # Features are cached across runs by content
+            self._deduplicator = AdvancedDeduplicator(
+                similarity_threshold=similarity_threshold,
+                cache_path=self.workspace / 'dedup_feature_cache.sqlite',
+                hash_method=self.config.dedup_hash_method
+            )
+        return self._deduplicator
+    
+    def _phash_prefilter(self, input_folder: Path, max_distance: int) -> Dict[str, str]:
+        """
+        Collapse near-identical images before the full dedup comparison.
+        
+        Walking images in the deduplicator's filename order, each image not yet
+        collapsed is kept as a representative and every later image within
+        max_distance bits of it (directly, not through a chain) is marked as
+        its duplicate.
+        
+        Args:
+            input_folder: Folder of downloaded images
+            max_distance: Largest pHash Hamming distance treated as a duplicate
+            
+        Returns:
+            Dict mapping each collapsed filename to its representative
+        """
+        from image_deduplicator_advanced import filename_sort_key
+        
+        names = sorted(self._list(input_folder), key=filename_sort_key)
+        if len(names) < 2:
+            return {}
+        
+        hashes, loaded = batch_phash([input_folder / name for name in names],
+                                     num_workers=self.config.num_workers)
+        labels = group_near_duplicates(hashes, max_distance, loaded)
+        
+        # Each label is the index of its group's representative
+        collapsed = {name: names[label] for i, (name, label) in enumerate(zip(names, labels))
+                     if label != i}
+        
+        print(f"🔎 pHash prefilter (≤{max_distance} bits): collapsed {len(collapsed)} of {len(names)} images")
+        return collapsed
+    
+    def step1_download_from_drive(self, prefetch=None) -> int:
         """
         Step 1: Download all images from Google Drive
+        
+        Args:
+            prefetch: Optional AdvancedDeduplicator; each file is analyzed on a
+                      background thread as soon as it is on disk, overlapping
+                      step 2's feature extraction with the downloads
+        
         Returns: Number of images downloaded
         """
         print("\n" + "=" * 70)
@@ -143,7 +389,19 @@ class MasterPipeline:
             creds_dict,
             scopes=['https://www.googleapis.com/auth/drive.readonly']
         )
-        service = build('drive', 'v3', credentials=creds)
+        
+        # Drive's discovery document ships with googleapiclient: read it once
+        # and build every service (one per download thread) from it, so no
+        # build() fetches or re-reads it. Each build parses its own copy,
+        # since the library adds parameters to the document as it goes.
+        drive_discovery = get_static_doc('drive', 'v3')
+        
+        def new_service():
+            if drive_discovery is None:
+                return build('drive', 'v3', credentials=creds, static_discovery=True)
+            return build_from_document(drive_discovery, credentials=creds)
+        
+        service = new_service()
         
         # Get folder ID from config
         folder_id = self.config.google_drive_folder_id
@@ -164,73 +422,232 @@ class MasterPipeline:
         
         # Download images
         download_folder = self.folders['downloaded']
-        print(f"\n📥 Downloading to: {download_folder}")
+        workers = max(1, self.config.download_concurrency)
+        print(f"\n📥 Downloading to: {download_folder} ({workers} parallel)")
+        
+        # Files are saved by name, so only fetch the first file of each name
+        # (two threads must never write the same path)
+        seen_names = set()
+        to_download = []
+        for img in images:
+            if img['name'] not in seen_names:
+                seen_names.add(img['name'])
+                to_download.append(img)
+        
+        # Files fetched and verified on earlier runs, by Drive file id:
+        # {id: {md5, name, size}}. A file whose md5Checksum is unchanged and
+        # that is still on disk isn't touched at all.
+        force = self.config.force_redownload
+        index_path = self.workspace / 'download_index.json'
+        index = _read_json(index_path) if index_path.exists() and not force else {}
+        
+        unchanged = []
+        if index:
+            remaining = []
+            for img in to_download:
+                entry = index.get(img['id'])
+                if (entry and img.get('md5Checksum') == entry['md5'] and entry['name'] == img['name']
+                        and (download_folder / img['name']).exists()):
+                    unchanged.append(img)
+                else:
+                    remaining.append(img)
+            to_download = remaining
+            print(f"⏭️  {len(unchanged)} images unchanged since the last run")
+        elif force:
+            print("🔁 Force re-download: ignoring files already on disk")
+        
+        # googleapiclient services aren't thread-safe: one per worker thread
+        thread_local = threading.local()
+        
+        def get_service():
+            if not hasattr(thread_local, 'service'):
+                thread_local.service = new_service()
+            return thread_local.service
+        
+        # Downloads are network-bound and analysis is CPU-bound, so a single
+        # consumer thread analyzes finished files while downloads continue
+        if prefetch is not None:
+            from image_deduplicator_advanced import IMAGE_EXTENSIONS
+            ready = queue.Queue(maxsize=64)
+            
+            def queue_for_analysis(path: Path):
+                # Skip types the deduplicator doesn't scan (e.g. HEIC)
+                if path.suffix.lower() in IMAGE_EXTENSIONS:
+                    ready.put(path)
+            
+            def analyze_ready():
+                while True:
+                    path = ready.get()
+                    if path is None:
+                        return
+                    prefetch.add_image(path)
+            
+            consumer = threading.Thread(target=analyze_ready, daemon=True)
+            consumer.start()
         
         downloaded = 0
-        for img in tqdm(images, desc="Downloading"):
-            try:
-                # Download
-                request = service.files().get_media(fileId=img['id'])
-                
-                output_path = download_folder / img['name']
+        updates = 0
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._download_one, get_service, img, download_folder, force): img
+                    for img in to_download
+                }
                 
-                # Skip if already downloaded
-                if output_path.exists():
-                    continue
+                # Unchanged files can be analyzed while the downloads run
+                if prefetch is not None:
+                    for img in unchanged:
+                        queue_for_analysis(download_folder / img['name'])
                 
-                with open(output_path, 'wb') as f:
-                    from io import BytesIO
-                    file_buffer = BytesIO()
-                    downloader = MediaIoBaseDownload(file_buffer, request)
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading"):
+                    img = futures[future]
+                    try:
+                        if future.result():
+                            downloaded += 1
+                    except Exception as e:
+                        print(f"❌ Failed to download {img['name']}: {e}")
+                        continue
+                    if prefetch is not None:
+                        queue_for_analysis(download_folder / img['name'])
+                    
+                    # The file on disk now matches Drive's md5Checksum
+                    if img.get('md5Checksum'):
+                        index[img['id']] = {
+                            'md5': img['md5Checksum'],
+                            'name': img['name'],
+                            'size': int(img.get('size', 0)),
+                        }
+                        updates += 1
+                        if updates % 200 == 0:
+                            _write_json(index_path, index)
+        finally:
+            if prefetch is not None:
+                ready.put(None)
+                consumer.join()
+            if updates:
+                _write_json(index_path, index)
+        
+        total = len(self._list(download_folder, invalidate=True))
+        print(f"\n✅ Downloaded {downloaded} new images")
+        print(f"📊 Total in folder: {total} images")
+        
+        return total
+    
+    def _download_one(self, get_service, img: Dict, download_folder: Path, force: bool = False) -> bool:
+        """
+        Download one Drive file straight to disk.
+        
+        The download is checked against Drive's md5Checksum (retried once on
+        a mismatch) before it is renamed into place.
+        
+        Args:
+            get_service: Returns the calling thread's Drive service
+            img: Drive file metadata (id, name, size, md5Checksum)
+            download_folder: Destination folder
+            force: Download even if the file is already on disk
+        
+        Returns: True if downloaded, False if it was already on disk
+        """
+        output_path = download_folder / img['name']
+        expected_md5 = img.get('md5Checksum')
+        
+        # Skip if already downloaded (and not in the download index yet).
+        # A size or checksum that differs from Drive's is a file truncated by
+        # an older run, so fetch it again.
+        if output_path.exists() and not force:
+            size_ok = 'size' not in img or output_path.stat().st_size == int(img['size'])
+            if size_ok and (expected_md5 is None or _file_md5(output_path) == expected_md5):
+                return False
+        
+        # Download to a .part file and rename when complete, so an
+        # interrupted run never leaves a truncated image that the
+        # exists() check above would then skip
+        part_path = output_path.with_name(output_path.name + '.part')
+        try:
+            for attempt in range(2):
+                request = get_service().files().get_media(fileId=img['id'])
+                with open(part_path, 'wb') as f:
+                    downloader = MediaIoBaseDownload(f, request, chunksize=8 * 1024 * 1024)
                     done = False
                     while not done:
-                        status, done = downloader.next_chunk()
-                    file_buffer.seek(0)
-                    f.write(file_buffer.read())
+                        status, done = downloader.next_chunk(num_retries=3)
                 
-                downloaded += 1
-                
-            except Exception as e:
-                print(f"❌ Failed to download {img['name']}: {e}")
-        
-        print(f"\n✅ Downloaded {downloaded} new images")
-        print(f"📊 Total in folder: {len(list(download_folder.glob('*')))} images")
+                if expected_md5 is None or _file_md5(part_path) == expected_md5:
+                    break
+            else:
+                raise ValueError("MD5 mismatch with Drive's md5Checksum")
+            os.replace(part_path, output_path)
+        finally:
+            if part_path.exists():
+                part_path.unlink()
         
-        return len(list(download_folder.glob('*')))
+        return True
     
     def _list_all_drive_images(self, service, folder_id: str) -> List[Dict]:
         """Recursively list all images from Google Drive"""
         extensions = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif', '.bmp', '.tiff', '.tif'}
         images = []
-        folders_to_process = [folder_id]
+        # (folder id, page token) listings still to fetch
+        pending = [(folder_id, None)]
+        
+        # Consecutive rounds that hit a retryable error
+        attempt = 0
         
-        while folders_to_process:
-            current_folder = folders_to_process.pop(0)
-            query = f"'{current_folder}' in parents and trashed=false"
-            page_token = None
+        while pending:
+            # One batch HTTP request per round; Drive allows 100 calls per batch
+            round_requests, pending = pending[:100], pending[100:]
+            responses = {}
+            
+            def collect(request_id, response, exception):
+                if exception is not None:
+                    if not _is_retryable(exception):
+                        raise exception
+                    return
+                responses[request_id] = response
             
-            while True:
-                results = service.files().list(
-                    q=query,
+            batch = service.new_batch_http_request(callback=collect)
+            for i, (current_folder, page_token) in enumerate(round_requests):
+                batch.add(service.files().list(
+                    q=f"'{current_folder}' in parents and trashed=false",
                     spaces='drive',
-                    fields='nextPageToken, files(id, name, mimeType)',
+                    fields='nextPageToken, files(id, name, mimeType, size, md5Checksum)',
                     pageToken=page_token,
-                    pageSize=100
-                ).execute()
-                
-                items = results.get('files', [])
+                    pageSize=1000
+                ), request_id=str(i))
+            try:
+                batch.execute()
+            except HttpError as e:
+                if not _is_retryable(e):
+                    raise
+            
+            # Throttled or failed listings go back on the queue after a backoff
+            failed = [req for i, req in enumerate(round_requests) if str(i) not in responses]
+            if failed:
+                attempt += 1
+                if attempt > DRIVE_MAX_RETRIES:
+                    raise RuntimeError(f"Drive listing still failing after {DRIVE_MAX_RETRIES} retries")
+                pending.extend(failed)
+                _backoff(attempt)
+            else:
+                attempt = 0
+            
+            for i, (current_folder, _) in enumerate(round_requests):
+                if str(i) not in responses:
+                    continue
+                results = responses[str(i)]
                 
-                for item in items:
+                for item in results.get('files', []):
                     if item['mimeType'] == 'application/vnd.google-apps.folder':
-                        folders_to_process.append(item['id'])
+                        pending.append((item['id'], None))
                     else:
                         ext = os.path.splitext(item['name'])[1].lower()
                         if ext in extensions:
                             images.append(item)
                 
+                # Fetch the folder's next page in the next round
                 page_token = results.get('nextPageToken')
-                if not page_token:
-                    break
+                if page_token:
+                    pending.append((current_folder, page_token))
         
         return images
     
@@ -267,6 +684,8 @@ class MasterPipeline:
         unique_folder = self.folders['unique']
         clusters_folder = self.folders['duplicate_clusters']
         
+        prefiltered = {}  # collapsed by the pHash prefilter -> representative
+        
         # Check if using LLM
         if use_llm:
             print("🤖 Using LLM-enhanced validation")
@@ -291,8 +710,7 @@ class MasterPipeline:
             )
             
             # Load validated duplicates
-            with open(self.workspace / "deduplication_results" / "validated_duplicates.json") as f:
-                duplicate_pairs = json.load(f)
+            duplicate_pairs = _read_json(self.workspace / "deduplication_results" / "validated_duplicates.json")
             
             # Build duplicate mapping
             duplicate_map = {}  # duplicate -> original
@@ -304,19 +722,20 @@ class MasterPipeline:
         else:
             print("⚡ Using advanced deduplicator only (no LLM)")
             
-            # Import and run deduplicator
-            sys.path.insert(0, str(SCRIPT_DIR / 'FaceDetectionBlur'))
-            from image_deduplicator_advanced import AdvancedDeduplicator
-            
             # Note: AdvancedDeduplicator uses similarity_threshold (higher = more similar required)
             # Pass threshold directly - higher values mean stricter matching
             similarity_threshold = threshold  # 0.85 means 85% similarity required
             
-            # Initialize deduplicator
-            deduplicator = AdvancedDeduplicator(similarity_threshold=similarity_threshold)
+            # Reuses images already analyzed during step 1, if any
+            deduplicator = self._get_deduplicator(similarity_threshold)
+            
+            # Cheap pass first: near-identical images never reach the
+            # feature comparison
+            if PHASH_BATCH_AVAILABLE and self.config.dedup_prefilter_distance >= 0:
+                prefiltered = self._phash_prefilter(input_folder, self.config.dedup_prefilter_distance)
             
             # Scan and analyze images
-            deduplicator.scan_images(input_folder)
+            deduplicator.scan_images(input_folder, exclude=set(prefiltered))
             
             if not deduplicator.images:
                 print("❌ No images found!")
@@ -337,6 +756,11 @@ class MasterPipeline:
             for img in deduplicator.images:
                 if img.is_duplicate and img.duplicate_of:
                     duplicate_map[img.filename] = img.duplicate_of
+            
+            # A collapsed image follows its representative into that one's
+            # cluster if the representative itself turned out a duplicate
+            for name, rep in prefiltered.items():
+                duplicate_map[name] = duplicate_map.get(rep, rep)
         
         print(f"\n✅ Found {len(duplicate_map)} duplicate images")
         
@@ -344,34 +768,17 @@ class MasterPipeline:
         print("\n📂 Creating cluster structure...")
         
         # Copy unique images and create clusters
-        all_images = list(input_folder.glob('*'))
+        all_images = self._list(input_folder)
         originals = set()
         duplicates = set()
         
-        for img_path in all_images:
-            img_name = img_path.name
-            
+        for img_name in all_images:
             if img_name in duplicate_map:
                 # It's a duplicate
                 duplicates.add(img_name)
             else:
-                # Check if it's an original (has duplicates pointing to it)
-                if img_name in duplicate_map.values():
-                    originals.add(img_name)
-                else:
-                    # Truly unique (no duplicates)
-                    originals.add(img_name)
-        
-        # Copy originals to unique folder
-        print(f"\n📋 Copying {len(originals)} unique images...")
-        for img_name in tqdm(originals, desc="Copying unique"):
-            src = input_folder / img_name
-            dst = unique_folder / img_name
-            if not dst.exists():
-                shutil.copy2(src, dst)
-        
-        # Create duplicate clusters
-        print(f"\n📁 Creating duplicate clusters...")
+                # An original with duplicates, or truly unique (no duplicates)
+                originals.add(img_name)
         
         # Group duplicates by original
         clusters = {}
@@ -380,20 +787,40 @@ class MasterPipeline:
                 clusters[orig] = []
             clusters[orig].append(dup)
         
-        for cluster_id, (original, duplicates_list) in enumerate(clusters.items(), 1):
+        def place_unique(img_name):
+            dst = unique_folder / img_name
+            if not dst.exists():
+                _link_or_copy(input_folder / img_name, dst)
+        
+        def place_cluster(cluster_id, original, duplicates_list):
             cluster_folder = clusters_folder / f"cluster_{cluster_id:04d}_{Path(original).stem}"
             cluster_folder.mkdir(exist_ok=True)
             
-            # Copy original
+            # Link original
             src = input_folder / original
             if src.exists():
-                shutil.copy2(src, cluster_folder / f"ORIGINAL_{original}")
+                _link_or_copy(src, cluster_folder / f"ORIGINAL_{original}")
             
-            # Copy duplicates
+            # Link duplicates
             for dup in duplicates_list:
                 src = input_folder / dup
                 if src.exists():
-                    shutil.copy2(src, cluster_folder / f"duplicate_{dup}")
+                    _link_or_copy(src, cluster_folder / f"duplicate_{dup}")
+        
+        # Each task is a few link/stat syscalls, which release the GIL
+        print(f"\n📋 Linking {len(originals)} unique images and creating {len(clusters)} duplicate clusters...")
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as executor:
+            futures = [executor.submit(place_unique, img_name) for img_name in originals]
+            futures += [
+                executor.submit(place_cluster, cluster_id, original, duplicates_list)
+                for cluster_id, (original, duplicates_list) in enumerate(clusters.items(), 1)
+            ]
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Organizing"):
+                future.result()
+        
+        # Both folders were just written, so drop any earlier listing
+        self._listing_cache.pop(unique_folder, None)
+        self._listing_cache.pop(clusters_folder, None)
         
         # Clean up temp folder
         if not use_llm and temp_dedup_output.exists():
@@ -405,6 +832,7 @@ class MasterPipeline:
             'duplicate_images': len(duplicates),
             'duplicate_pairs': len(duplicate_map),
             'clusters': len(clusters),
+            'phash_prefilter_removed': len(prefiltered),
             'compression_ratio': f"{(1 - len(originals) / len(all_images)) * 100:.1f}%" if len(all_images) > 0 else "0%"
         }
         
@@ -413,11 +841,11 @@ class MasterPipeline:
         print(f"   Unique images: {stats['unique_images']}")
         print(f"   Duplicate images: {stats['duplicate_images']}")
         print(f"   Clusters created: {stats['clusters']}")
+        print(f"   Removed by pHash prefilter: {stats['phash_prefilter_removed']}")
         print(f"   Compression: {stats['compression_ratio']}")
         
         # Save stats
-        with open(self.workspace / 'deduplication_stats.json', 'w') as f:
-            json.dump(stats, f, indent=2)
+        _write_json(self.workspace / 'deduplication_stats.json', stats)
         
         return stats
     
@@ -444,7 +872,7 @@ class MasterPipeline:
         print(f"📤 Output: {output_folder}")
         
         # Get images to process
-        images = list(input_folder.glob('*'))
+        images = self._list(input_folder)
         
         # Apply image limit if in testing mode
         if self.config.limit_images and len(images) > self.config.limit_images:
@@ -474,74 +902,34 @@ class MasterPipeline:
         print()
         
         try:
-            import subprocess
-            import sys
+            # Run stage 3 in this process: no interpreter start-up (with
+            # NUM_WORKERS>1 it spawns its own worker processes)
+            sys.path.insert(0, str(pipeline_script.parent))
+            from stage3_obfuscate_faces_enhanced import run as run_stage3
             
-            # Run pipeline with live output streaming
-            process = subprocess.Popen(
-                [
-                    'python3',
-                    str(pipeline_script),
-                    '--input', str(input_folder),
-                    '--output', str(temp_pipeline_output),
-                    '--qa-dir', str(temp_qa_dir)
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
+            run_stage3(
+                input_dir=input_folder,
+                obfuscated_dir=temp_pipeline_output,
+                qa_dir=temp_qa_dir,
+                timeout=self.config.pipeline_timeout
             )
             
-            # Stream output line by line
-            print("📊 Pipeline Progress:")
-            print("-" * 70)
-            
-            output_lines = []
-            for line in process.stdout:
-                # Print progress bars and important lines
-                line = line.rstrip()
-                if line:
-                    # Show progress bars (contains % or 'it/s')
-                    if '%' in line or 'it/s' in line or 'Obfuscating:' in line:
-                        print(f"\r{line}", end='', flush=True)
-                    # Show stage headers
-                    elif 'STAGE' in line or '===' in line:
-                        print(f"\n{line}")
-                    # Show summary lines
-                    elif any(keyword in line for keyword in ['Successfully', 'Clean images', 'No faces', 'Verification', 'QA review']):
-                        print(f"\n   {line}")
-                    
-                    output_lines.append(line)
-            
-            # Wait for process to complete
-            return_code = process.wait(timeout=3600)
-            
-            print("\n" + "-" * 70)
             print(f"\n📊 Pipeline execution complete!")
-            print(f"   Return code: {return_code}")
+            print("   ✅ All stages completed successfully!")
             
-            if return_code != 0:
-                print(f"\n⚠️  Pipeline had issues:")
-                print(f"\n--- Last 30 lines of output ---")
-                print('\n'.join(output_lines[-30:]))
-            else:
-                print("   ✅ All stages completed successfully!")
-            
-        except subprocess.TimeoutExpired:
-            print("\n❌ Pipeline timed out after 1 hour")
-            if process:
-                process.kill()
+        except TimeoutError:
+            print(f"\n❌ Pipeline timed out after {self.config.pipeline_timeout}s")
             return {'blurred': 0, 'clean': 0, 'qa_required': 0, 'skipped': 0, 'failed': len(images)}
-        except Exception as e:
+        except (Exception, SystemExit) as e:
+            # SystemExit: stage 3 exits when a detector library is missing
             print(f"\n❌ Pipeline error: {e}")
             import traceback
             traceback.print_exc()
             return {'blurred': 0, 'clean': 0, 'qa_required': 0, 'skipped': 0, 'failed': len(images)}
         
         # The pipeline uses the paths we provided:
-        # - temp_pipeline_output (--output parameter) - images with blurred faces that passed verification
-        # - temp_qa (--qa-dir parameter) - images with blurred faces that need QA review
+        # - temp_pipeline_output (obfuscated_dir) - images with blurred faces that passed verification
+        # - temp_qa (qa_dir) - images with blurred faces that need QA review
         # - biometric_clean_dir (from config) - images without any faces detected
         
         pipeline_obfuscated_folder = temp_pipeline_output  # Use the temp folder we passed
@@ -549,56 +937,41 @@ class MasterPipeline:
         pipeline_qa_folder = temp_qa_dir  # Use the temp QA folder we passed
         
         processed_stats = {'blurred': 0, 'clean': 0, 'qa_required': 0, 'skipped': 0, 'failed': 0}
+        results = []  # (filename, compliance_status) for the images table
         
         print("\n📂 Organizing processed images...")
         print(f"   Reading from pipeline output folders...")
         
-        # Copy blurred/obfuscated images
-        if pipeline_obfuscated_folder.exists():
-            obfuscated_images = list(pipeline_obfuscated_folder.glob('*'))
-            print(f"   Found {len(obfuscated_images)} obfuscated images")
-            for img_path in obfuscated_images:
-                if img_path.is_file() and not img_path.name.startswith('.'):
-                    try:
-                        shutil.copy2(img_path, blurred_folder / img_path.name)
-                        processed_stats['blurred'] += 1
-                    except Exception as e:
-                        print(f"   ⚠️  Error copying blurred image {img_path.name}: {e}")
-        
-        # Copy clean images (no faces)
-        if pipeline_clean_folder.exists():
-            clean_images = list(pipeline_clean_folder.glob('*'))
-            print(f"   Found {len(clean_images)} clean images")
-            for img_path in clean_images:
-                if img_path.is_file() and not img_path.name.startswith('.'):
-                    try:
-                        shutil.copy2(img_path, clean_folder / img_path.name)
-                        processed_stats['clean'] += 1
-                    except Exception as e:
-                        print(f"   ⚠️  Error copying clean image {img_path.name}: {e}")
-        
-        # Copy QA review images (verification failed) - treat as blurred
-        if pipeline_qa_folder.exists():
-            qa_images = list(pipeline_qa_folder.glob('*'))
-            print(f"   Found {len(qa_images)} QA review images (adding to blurred folder)")
-            for img_path in qa_images:
-                if img_path.is_file() and not img_path.name.startswith('.'):
-                    try:
-                        shutil.copy2(img_path, blurred_folder / img_path.name)
-                        processed_stats['qa_required'] += 1
-                    except Exception as e:
-                        print(f"   ⚠️  Error copying QA image {img_path.name}: {e}")
+        # Move each pipeline output folder into place:
+        # (source folder, destination, stats key, compliance status, label)
+        # QA review images (verification failed) are treated as blurred
+        move_plan = [
+            (pipeline_obfuscated_folder, blurred_folder, 'blurred', 'processed', 'obfuscated images'),
+            (pipeline_clean_folder, clean_folder, 'clean', 'clean', 'clean images'),
+            (pipeline_qa_folder, blurred_folder, 'qa_required', 'flagged', 'QA review images (adding to blurred folder)'),
+        ]
+        for src_folder, dst_folder, key, status, label in move_plan:
+            if not src_folder.exists():
+                continue
+            entries = list(_iter_files(src_folder))
+            print(f"   Found {len(entries)} {label}")
+            for entry in entries:
+                try:
+                    _move(entry.path, dst_folder / entry.name)
+                    processed_stats[key] += 1
+                    results.append((entry.name, status))
+                except Exception as e:
+                    print(f"   ⚠️  Error moving {entry.name}: {e}")
         
         # Read pipeline results JSON to get accurate stats
         pipeline_results_file = self.config.biometric_results_dir / 'obfuscation_results.json'
         if pipeline_results_file.exists():
             try:
-                with open(pipeline_results_file) as f:
-                    pipeline_results = json.load(f)
-                    pipeline_stats = pipeline_results.get('statistics', {})
-                    processed_stats['failed'] = pipeline_stats.get('failed', 0)
-                    processed_stats['skipped'] = pipeline_stats.get('skipped', 0)
-                    print(f"   ✓ Loaded pipeline statistics from results file")
+                pipeline_results = _read_json(pipeline_results_file)
+                pipeline_stats = pipeline_results.get('statistics', {})
+                processed_stats['failed'] = pipeline_stats.get('failed', 0)
+                processed_stats['skipped'] = pipeline_stats.get('skipped', 0)
+                print(f"   ✓ Loaded pipeline statistics from results file")
             except Exception as e:
                 print(f"   ⚠️  Could not read pipeline results: {e}")
         
@@ -614,17 +987,8 @@ class MasterPipeline:
                 print(f"   ⚠️  {unaccounted} images unaccounted for (marked as failed)")
         
         print(f"\n🧹 Cleaning up pipeline output folders...")
-        # Clean up pipeline folders after copying
-        for folder in [pipeline_obfuscated_folder, pipeline_clean_folder, pipeline_qa_folder]:
-            if folder.exists():
-                for img_path in folder.glob('*'):
-                    if img_path.is_file():
-                        try:
-                            img_path.unlink()
-                        except:
-                            pass
-        
-        # Clean up temp folders
+        
+        # Images were moved out above, so only the temp folders remain
         shutil.rmtree(temp_pipeline_output, ignore_errors=True)
         shutil.rmtree(temp_qa_dir, ignore_errors=True)
         
@@ -657,11 +1021,50 @@ class MasterPipeline:
             print(f"   ✅ All {input_count} images accounted for!")
         
         # Save stats
-        with open(self.workspace / 'pipeline_stats.json', 'w') as f:
-            json.dump(processed_stats, f, indent=2)
+        _write_json(self.workspace / 'pipeline_stats.json', processed_stats)
+        
+        if self.config.sync_results_to_db:
+            self._sync_results_to_db(results)
         
         return processed_stats
     
+    def _sync_results_to_db(self, results: List[tuple], batch_size: int = 1000):
+        """
+        Record step 3 outcomes on the matching rows of the images table.
+        
+        Each batch is a single executemany UPDATE and everything is committed
+        once at the end, instead of a round-trip and commit per image.
+        
+        Args:
+            results: (filename, compliance_status) pairs
+            batch_size: Rows sent per executemany call
+        """
+        if not APP_AVAILABLE:
+            print("⚠️  SYNC_RESULTS_TO_DB is set but the backend app is not importable, skipping")
+            return
+        if not results:
+            return
+        
+        update = text('''
+            UPDATE images
+            SET compliance_processed = TRUE,
+                compliance_status = :status
+            WHERE filename = :filename
+        ''')
+        rows = [{'filename': filename, 'status': status} for filename, status in results]
+        
+        db = SessionLocal()
+        try:
+            for start in range(0, len(rows), batch_size):
+                db.execute(update, rows[start:start + batch_size])
+            db.commit()
+            print(f"🗄️  Synced {len(rows)} results to the images table")
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️  Could not sync results to the database: {e}")
+        finally:
+            db.close()
+    
     def step4_consolidate_output(self) -> Dict:
         """
         Step 4: Consolidate final output
@@ -677,14 +1080,15 @@ class MasterPipeline:
         final_folder = self.folders['final_output']
         processed_folder = self.folders['processed_unique']
         
-        # Copy all processed images to final output
+        # Link all processed images into final output (no data is copied;
+        # processed_unique stays in place as the backing store)
         for subfolder in ['blurred', 'clean']:
             src_folder = processed_folder / subfolder
             if src_folder.exists():
-                for img in src_folder.glob('*'):
-                    shutil.copy2(img, final_folder / img.name)
+                for entry in _iter_files(src_folder):
+                    _link_or_symlink(Path(entry.path), final_folder / entry.name)
         
-        final_count = len(list(final_folder.glob('*')))
+        final_count = len(self._list(final_folder, invalidate=True))
         
         # Create manifest
         manifest = {
@@ -692,15 +1096,14 @@ class MasterPipeline:
             'total_final_images': final_count,
             'workspace': str(self.workspace),
             'folders': {
-                'downloaded': len(list(self.folders['downloaded'].glob('*'))),
-                'unique': len(list(self.folders['unique'].glob('*'))),
+                'downloaded': len(self._list(self.folders['downloaded'])),
+                'unique': len(self._list(self.folders['unique'])),
                 'processed': final_count,
-                'clusters': len(list(self.folders['duplicate_clusters'].glob('*')))
+                'clusters': len(self._list(self.folders['duplicate_clusters']))
             }
         }
         
-        with open(final_folder / 'manifest.json', 'w') as f:
-            json.dump(manifest, f, indent=2)
+        _write_json(final_folder / 'manifest.json', manifest)
         
         print(f"\n✅ Final output ready: {final_folder}")
         print(f"   📊 {final_count} images ready for annotation")
@@ -742,10 +1145,12 @@ class MasterPipeline:
             return
         
         start_time = datetime.now()
+        self._listing_cache.clear()
         
-        # Step 1: Download
+        # Step 1: Download (analyzing images for step 2 as they arrive)
         if download:
-            downloaded_count = self.step1_download_from_drive()
+            prefetch = self._get_deduplicator(dedup_threshold) if deduplicate and not use_llm else None
+            downloaded_count = self.step1_download_from_drive(prefetch=prefetch)
             if downloaded_count == 0:
                 print("❌ No images to process")
                 return
@@ -768,23 +1173,29 @@ class MasterPipeline:
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds()
         
-        print("\n" + "=" * 70)
-        print("✅ PIPELINE COMPLETE")
-        print("=" * 70)
-        print(f"⏱️  Total time: {duration / 60:.1f} minutes")
-        print(f"\n📁 Final output: {self.folders['final_output']}")
-        print(f"   Ready for annotation: {manifest['total_final_images']} images")
-        
-        print(f"\n📂 Workspace structure:")
-        print(f"   • Downloaded: {self.folders['downloaded']}")
-        print(f"   • Unique: {self.folders['unique']}")
-        print(f"   • Duplicate clusters: {self.folders['duplicate_clusters']}")
-        print(f"   • Processed: {self.folders['processed_unique']}")
-        print(f"   • Final output: {self.folders['final_output']}")
+        # Written in one go rather than a print (and flush) per line
+        summary = [
+            "",
+            "=" * 70,
+            "✅ PIPELINE COMPLETE",
+            "=" * 70,
+            f"⏱️  Total time: {duration / 60:.1f} minutes",
+            f"\n📁 Final output: {self.folders['final_output']}",
+            f"   Ready for annotation: {manifest['total_final_images']} images",
+            f"\n📂 Workspace structure:",
+            f"   • Downloaded: {self.folders['downloaded']}",
+            f"   • Unique: {self.folders['unique']}",
+            f"   • Duplicate clusters: {self.folders['duplicate_clusters']}",
+            f"   • Processed: {self.folders['processed_unique']}",
+            f"   • Final output: {self.folders['final_output']}",
+        ]
+        sys.stdout.write("\n".join(summary) + "\n")
+        sys.stdout.flush()
 
 
-def main():
-    """Main entry point for the pipeline."""
+@lru_cache(maxsize=1)
+def _build_parser() -> argparse.ArgumentParser:
+    """Command-line parser for main(), built once and reused."""
     parser = argparse.ArgumentParser(description='Master image processing pipeline')
     parser.add_argument('--workspace', help='Workspace directory (overrides env)')
     parser.add_argument('--download', action='store_true', help='Download from Google Drive')
@@ -796,15 +1207,29 @@ def main():
     parser.add_argument('--max-llm', type=int, help='Max LLM validations (cost control)')
     parser.add_argument('--config', action='store_true', help='Show configuration and exit')
     parser.add_argument('--dry-run', action='store_true', help='Dry run mode (no processing)')
+    parser.add_argument('--force-redownload', action='store_true',
+                        help='Download every Drive file again, ignoring the download index')
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Main entry point for the pipeline.
     
-    args = parser.parse_args()
+    Args:
+        argv: Command-line arguments (default: sys.argv[1:])
+    """
+    args = _build_parser().parse_args(argv)
     
-    # Get configuration
-    config = get_config()
+    # Get configuration (a copy, so CLI overrides don't stick to the shared
+    # instance across main() calls in one process)
+    config = copy.copy(get_config())
     
     # Override config with command-line args
     if args.dry_run:
         config.dry_run = True
+    if args.force_redownload:
+        config.force_redownload = True
     
     # Show config if requested
     if args.config:
@@ -8,20 +8,65 @@ Provides a centralized config object for all pipeline components.
 """
 
 import os
+import functools
 from pathlib import Path
 from typing import Optional
-from dotenv import load_dotenv
+from dotenv import dotenv_values
+
+@functools.lru_cache(maxsize=4)
+def _load_env(path_str: str, mtime: float) -> dict:
+    """Parse a .env file; cached per (path, mtime), so only edits re-parse."""
+    return dotenv_values(path_str)
+
+def load_env_file(env_file: Path):
+    """
+    Load a .env file into os.environ (like load_dotenv).
+    
+    Variables already set in the environment take precedence.
+    """
+    values = _load_env(str(env_file), env_file.stat().st_mtime)
+    for key, value in values.items():
+        if value is not None:
+            os.environ.setdefault(key, value)
 
 # Load .env file from parent backend directory (single source of truth)
 backend_env = Path(__file__).parent.parent / '.env'
 
 if backend_env.exists():
-    load_dotenv(backend_env)
+    load_env_file(backend_env)
     print(f"[Config] Loaded: {backend_env}")
 else:
     print(f"[Config] WARNING: No .env file found at {backend_env}")
     print("[Config] Using environment variables or defaults")
 
+# Configurable directories: (attribute, base attribute, env var, default).
+# Entries are resolved in order, so a base must be listed before the
+# directories under it.
+_PATH_SPEC = (
+    # Stage folders
+    ('downloaded_dir', 'workspace', 'DOWNLOADED_IMAGES_DIR', '01_downloaded_from_drive'),
+    ('unique_dir', 'workspace', 'UNIQUE_IMAGES_DIR', '02_unique_images'),
+    ('duplicate_clusters_dir', 'workspace', 'DUPLICATE_CLUSTERS_DIR', '02_duplicate_clusters'),
+    ('biometric_processed_dir', 'workspace', 'BIOMETRIC_PROCESSED_DIR', '03_biometric_processed'),
+    ('final_output_dir', 'workspace', 'FINAL_OUTPUT_DIR', '04_final_output'),
+    # Biometric pipeline
+    ('biometric_pipeline_dir', 'backend_dir', 'BIOMETRIC_PIPELINE_DIR', 'biometric_compliance_pipeline'),
+    ('biometric_input_dir', 'biometric_pipeline_dir', 'BIOMETRIC_INPUT_DIR', 'data/input'),
+    ('biometric_output_dir', 'biometric_pipeline_dir', 'BIOMETRIC_OUTPUT_DIR', 'data/obfuscated'),
+    ('biometric_clean_dir', 'biometric_pipeline_dir', 'BIOMETRIC_CLEAN_DIR', 'data/clean'),
+    ('biometric_qa_dir', 'biometric_pipeline_dir', 'BIOMETRIC_QA_DIR', 'data/qa_review'),
+    ('biometric_results_dir', 'biometric_pipeline_dir', 'BIOMETRIC_RESULTS_DIR', 'results'),
+    ('biometric_logs_dir', 'biometric_pipeline_dir', 'BIOMETRIC_LOGS_DIR', 'results/logs'),
+)
+
+def _default_workers(ceiling: int = 16) -> int:
+    """CPUs this process may run on (falls back to cpu_count), capped at ceiling."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 4
+    return min(ceiling, cpus)
+
 class PipelineConfig:
     """Central configuration for the master pipeline."""
     
@@ -37,30 +82,20 @@ class PipelineConfig:
         else:
             self.workspace = self.backend_dir / workspace
         
-        # Stage folders
-        self.downloaded_dir = self.workspace / os.getenv('DOWNLOADED_IMAGES_DIR', '01_downloaded_from_drive')
-        self.unique_dir = self.workspace / os.getenv('UNIQUE_IMAGES_DIR', '02_unique_images')
-        self.duplicate_clusters_dir = self.workspace / os.getenv('DUPLICATE_CLUSTERS_DIR', '02_duplicate_clusters')
-        self.biometric_processed_dir = self.workspace / os.getenv('BIOMETRIC_PROCESSED_DIR', '03_biometric_processed')
-        self.final_output_dir = self.workspace / os.getenv('FINAL_OUTPUT_DIR', '04_final_output')
-        
-        # ==================== BIOMETRIC PIPELINE PATHS ====================
-        biometric_base = os.getenv('BIOMETRIC_PIPELINE_DIR', 'biometric_compliance_pipeline')
-        self.biometric_pipeline_dir = self.backend_dir / biometric_base
-        
-        self.biometric_input_dir = self.biometric_pipeline_dir / os.getenv('BIOMETRIC_INPUT_DIR', 'data/input')
-        self.biometric_output_dir = self.biometric_pipeline_dir / os.getenv('BIOMETRIC_OUTPUT_DIR', 'data/obfuscated')
-        self.biometric_clean_dir = self.biometric_pipeline_dir / os.getenv('BIOMETRIC_CLEAN_DIR', 'data/clean')
-        self.biometric_qa_dir = self.biometric_pipeline_dir / os.getenv('BIOMETRIC_QA_DIR', 'data/qa_review')
-        self.biometric_results_dir = self.biometric_pipeline_dir / os.getenv('BIOMETRIC_RESULTS_DIR', 'results')
-        self.biometric_logs_dir = self.biometric_pipeline_dir / os.getenv('BIOMETRIC_LOGS_DIR', 'results/logs')
-        
-        # Biometric pipeline scripts
+        # Stage folders and biometric pipeline paths
+        for attr, base, env_var, default in _PATH_SPEC:
+            setattr(self, attr, getattr(self, base) / os.getenv(env_var, default))
+        
+        # ==================== BIOMETRIC PIPELINE SCRIPTS ====================
         self.biometric_scripts_dir = self.biometric_pipeline_dir / 'scripts'
         self.biometric_run_script = self.biometric_scripts_dir / 'stage3_obfuscate_faces_enhanced.py'
         
         # ==================== DEDUPLICATION SETTINGS ====================
         self.dedup_threshold = float(os.getenv('DEDUP_THRESHOLD', '0.32'))
+        self.dedup_hash_method = os.getenv('DEDUP_HASH_METHOD', 'phash').lower()
+        # pHash distance (bits) under which images are collapsed before the
+        # full comparison; -1 disables the prefilter
+        self.dedup_prefilter_distance = int(os.getenv('DEDUP_PREFILTER_DISTANCE', '2'))
         self.use_llm_validation = os.getenv('USE_LLM_VALIDATION', 'false').lower() == 'true'
         self.max_llm_validations = int(os.getenv('MAX_LLM_VALIDATIONS', '100'))
         
@@ -74,6 +109,8 @@ class PipelineConfig:
         # ==================== GOOGLE DRIVE CONFIG ====================
         self.google_drive_folder_id = os.getenv('GOOGLE_DRIVE_FOLDER_ID')
         self.google_service_account_file = os.getenv('GOOGLE_SERVICE_ACCOUNT_FILE')
+        self.download_concurrency = int(os.getenv('DOWNLOAD_CONCURRENCY', '16'))
+        self.force_redownload = os.getenv('FORCE_REDOWNLOAD', 'false').lower() == 'true'
         
         # ==================== OPENAI API ====================
         self.openai_api_key = os.getenv('OPENAI_API_KEY')
@@ -88,10 +125,11 @@ class PipelineConfig:
         
         # ==================== DATABASE CONFIG ====================
         self.database_url = os.getenv('DATABASE_URL', 'sqlite:///./photo_annotation.db')
+        self.sync_results_to_db = os.getenv('SYNC_RESULTS_TO_DB', 'false').lower() == 'true'
         
         # ==================== PIPELINE BEHAVIOR ====================
         self.verbose_logging = os.getenv('VERBOSE_LOGGING', 'true').lower() == 'true'
-        self.num_workers = int(os.getenv('NUM_WORKERS', '4'))
+        self.num_workers = int(os.getenv('NUM_WORKERS') or _default_workers())
         self.pipeline_timeout = int(os.getenv('PIPELINE_TIMEOUT', '3600'))
         self.cleanup_temp_files = os.getenv('CLEANUP_TEMP_FILES', 'true').lower() == 'true'
         
@@ -110,9 +148,16 @@ class PipelineConfig:
         self.run_deduplicate_by_default = os.getenv('RUN_DEDUPLICATE_BY_DEFAULT', 'false').lower() == 'true'
         self.run_biometric_by_default = os.getenv('RUN_BIOMETRIC_BY_DEFAULT', 'false').lower() == 'true'
         self.run_all_by_default = os.getenv('RUN_ALL_BY_DEFAULT', 'false').lower() == 'true'
+        
+        # Set once directories exist / validation has run (see below)
+        self._dirs_created = False
+        self._validation: Optional[tuple[bool, list[str]]] = None
     
     def create_directories(self):
-        """Create all necessary directories for the pipeline."""
+        """Create all necessary directories for the pipeline (once per process)."""
+        if self._dirs_created:
+            return
+        
         directories = [
             self.workspace,
             self.downloaded_dir,
@@ -129,13 +174,21 @@ class PipelineConfig:
         ]
         
         for directory in directories:
-            directory.mkdir(parents=True, exist_ok=True)
+            os.makedirs(directory, exist_ok=True)
+        self._dirs_created = True
     
-    def validate(self) -> tuple[bool, list[str]]:
+    def validate(self, refresh: bool = False) -> tuple[bool, list[str]]:
         """
         Validate configuration.
+        
+        The result is cached; pass refresh=True to check again (e.g. after
+        changing settings or the biometric pipeline on disk).
+        
         Returns: (is_valid, list_of_errors)
         """
+        if self._validation is not None and not refresh:
+            return self._validation
+        
         errors = []
         
         # Check critical paths exist
@@ -155,12 +208,21 @@ class PipelineConfig:
         if not 0 <= self.face_verification_threshold <= 1:
             errors.append(f"Invalid FACE_VERIFICATION_THRESHOLD: {self.face_verification_threshold} (must be 0-1)")
         
+        if not -1 <= self.dedup_prefilter_distance <= 64:
+            errors.append(f"Invalid DEDUP_PREFILTER_DISTANCE: {self.dedup_prefilter_distance} (must be -1 to 64)")
+        
         # Validate obfuscation method
         valid_methods = {'egoblur', 'gaussian', 'pixelate', 'solid'}
         if self.obfuscation_method not in valid_methods:
             errors.append(f"Invalid OBFUSCATION_METHOD: {self.obfuscation_method} (must be one of {valid_methods})")
         
-        return (len(errors) == 0, errors)
+        # Validate dedup hash method
+        valid_hashes = {'phash', 'dhash'}
+        if self.dedup_hash_method not in valid_hashes:
+            errors.append(f"Invalid DEDUP_HASH_METHOD: {self.dedup_hash_method} (must be one of {valid_hashes})")
+        
+        self._validation = (len(errors) == 0, errors)
+        return self._validation
     
     def print_config(self):
         """Print configuration summary."""
@@ -181,6 +243,8 @@ class PipelineConfig:
         
         print(f"\n⚙️  Settings:")
         print(f"   Dedup Threshold:     {self.dedup_threshold}")
+        print(f"   Dedup Hash Method:   {self.dedup_hash_method}")
+        print(f"   Dedup Prefilter:     {self.dedup_prefilter_distance}")
         print(f"   Use LLM Validation:  {self.use_llm_validation}")
         print(f"   Face Detection Conf: {self.face_detection_confidence}")
         print(f"   Obfuscation Method:  {self.obfuscation_method}")
@@ -197,12 +261,20 @@ class PipelineConfig:
         
         print("=" * 70)
 
-# Global config instance
-config = PipelineConfig()
+# Global config instance, built on first use
+_config: Optional[PipelineConfig] = None
 
 def get_config() -> PipelineConfig:
-    """Get the global pipeline configuration."""
-    return config
+    """
+    Get the global pipeline configuration.
+    
+    Built from the environment on first call; later calls return the same
+    shared instance, so callers that override settings should copy it.
+    """
+    global _config
+    if _config is None:
+        _config = PipelineConfig()
+    return _config
 
 if __name__ == '__main__':
     # Test configuration
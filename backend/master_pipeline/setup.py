@@ -4,6 +4,8 @@ Setup script for Master Image Processing Pipeline
 Helps initialize the environment and verify dependencies
 """
 
+import hashlib
+import os
 import subprocess
 import sys
 from pathlib import Path
@@ -25,11 +27,28 @@ def check_python_version():
         print(f"   ❌ Python {version.major}.{version.minor}.{version.micro} (need 3.8+)")
         return False
 
+# Records what the last successful install was for (see install_dependencies).
+# Kept inside the environment, so it goes away when the venv is recreated.
+DEPS_MARKER = Path(sys.prefix) / ".deps-installed"
+
 def install_dependencies():
-    """Install required packages"""
+    """Install required packages (skipped if requirements.txt is unchanged)"""
     print("\n📦 Installing dependencies...")
+    
+    # Same requirements for the same interpreter: nothing to do
+    req_hash = hashlib.sha256(
+        Path("requirements.txt").read_bytes() + sys.executable.encode()
+    ).hexdigest()
+    if DEPS_MARKER.exists() and DEPS_MARKER.read_text(errors="ignore").strip() == req_hash:
+        print("   ✅ Dependencies up to date (requirements.txt unchanged)")
+        return True
+    
     try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt", "--prefer-binary"])
+        try:
+            DEPS_MARKER.write_text(req_hash + "\n")
+        except OSError:
+            pass  # Read-only environment (e.g. system Python): just don't skip next time
         print("   ✅ Dependencies installed")
         return True
     except subprocess.CalledProcessError:
@@ -53,8 +72,9 @@ def create_folder_structure():
         "biometric_compliance_pipeline/results",
     ]
     
-    for folder in folders:
-        Path(folder).mkdir(parents=True, exist_ok=True)
+    # Every entry is a leaf, so makedirs creates each shared parent once
+    for folder in sorted(set(folders)):
+        os.makedirs(folder, exist_ok=True)
     
     print("   ✅ Folder structure created")
     return True
@@ -85,9 +105,20 @@ def verify_models():
         ("biometric_compliance_pipeline/yolov8n.pt", "YOLO animal detection"),
     ]
     
+    # One directory listing per folder instead of a stat per model
+    present = {}
+    for model_path, _ in models:
+        folder = os.path.dirname(model_path)
+        if folder not in present:
+            try:
+                with os.scandir(folder) as entries:
+                    present[folder] = {entry.name for entry in entries}
+            except OSError:
+                present[folder] = set()
+    
     all_present = True
     for model_path, description in models:
-        if Path(model_path).exists():
+        if os.path.basename(model_path) in present[os.path.dirname(model_path)]:
             print(f"   ✅ {description}")
         else:
             print(f"   ❌ {description} - {model_path}")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for phash_batch.group_near_duplicates
+
+Run with: python -m unittest test_phash_batch
+"""
+
+import unittest
+
+import numpy as np
+
+from phash_batch import group_near_duplicates
+
+
+def _hashes(*values):
+    """Pack 64-bit integers into the (N, 8) uint8 layout batch_phash() returns."""
+    return np.array(values, dtype='>u8').view(np.uint8).reshape(len(values), 8)
+
+
+class GroupNearDuplicatesTest(unittest.TestCase):
+
+    def test_chain_is_not_transitive(self):
+        # A~B and B~C at 2 bits, but A and C are 4 bits apart
+        hashes = _hashes(0b0000, 0b0011, 0b1111)
+        labels = group_near_duplicates(hashes, max_distance=2)
+        self.assertEqual(labels.tolist(), [0, 0, 2])
+
+    def test_direct_matches_share_representative(self):
+        hashes = _hashes(0b0000, 0b0001, 0b0010)
+        labels = group_near_duplicates(hashes, max_distance=2)
+        self.assertEqual(labels.tolist(), [0, 0, 0])
+
+    def test_invalid_rows_are_never_linked(self):
+        hashes = _hashes(0, 0, 0)
+        valid = np.array([True, False, True])
+        labels = group_near_duplicates(hashes, max_distance=2, valid=valid)
+        self.assertEqual(labels.tolist(), [0, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
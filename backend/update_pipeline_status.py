@@ -1,10 +1,15 @@
 """
 Update the pipeline status in the backend API to reflect the completed terminal pipeline run.
 """
-import requests
 import json
 from pathlib import Path
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # Read the actual pipeline results
 results_file = Path(__file__).parent / "master_pipeline" / "biometric_compliance_pipeline" / "results" / "obfuscation_results.json"
 
@@ -12,8 +17,8 @@ if not results_file.exists():
     print(f"❌ Results file not found: {results_file}")
     exit(1)
 
-with open(results_file, 'r') as f:
-    results = json.load(f)
+with open(results_file, 'rb') as f:
+    results = orjson.loads(f.read()) if ORJSON_AVAILABLE else json.load(f)
 
 print("📊 Actual Pipeline Results:")
 print(f"   Total images: {results['total_images']}")
@@ -70,4 +75,7 @@ print()
 print("   The easiest way is to run the pipeline from the UI itself next time.")
 print()
 print("   For now, here's what the status should show:")
-print(json.dumps(status_update, indent=2))
+if ORJSON_AVAILABLE:
+    print(orjson.dumps(status_update, option=orjson.OPT_INDENT_2).decode())
+else:
+    print(json.dumps(status_update, indent=2))